@@ -2,24 +2,28 @@
 """
 Phase 1: Scrape all articles from Atom helpdesk.
 
-Outputs: data/raw/articles.json
+Outputs: data/raw/articles.json, data/intermediate/article_prompt_cache.json
 """
 
 import os
 import sys
-import json
+import asyncio
 import logging
 import argparse
 from pathlib import Path
 from datetime import datetime
+from typing import Optional
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-import yaml
 from tqdm import tqdm
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from utils.config import load_config
 from utils.scraper import Scraper
+from utils.jsonio import dump_json, dump_json_array, iter_jsonl, JsonlAppender
 
 # Setup logging
 logging.basicConfig(
@@ -33,135 +37,217 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def load_config() -> dict:
-    """Load configuration from config.yaml."""
-    config_path = Path(__file__).parent.parent / 'config' / 'config.yaml'
-    with open(config_path) as f:
-        return yaml.safe_load(f)
+def save_checkpoint(checkpoint_path: Path, data: dict):
+    """Save checkpoint summary (phase and counts)."""
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    dump_json(checkpoint_path, data)
 
 
-def load_checkpoint(checkpoint_path: Path) -> dict:
-    """Load checkpoint if it exists."""
-    if checkpoint_path.exists():
-        with open(checkpoint_path) as f:
-            return json.load(f)
-    return {}
+def iter_logged_articles(wal_path: Path):
+    """Yield articles from the article log, first occurrence of each ID only."""
+    seen_ids = set()
+    for article in iter_jsonl(wal_path):
+        if article['article_id'] not in seen_ids:
+            seen_ids.add(article['article_id'])
+            yield article
 
 
-def save_checkpoint(checkpoint_path: Path, data: dict):
-    """Save checkpoint data."""
-    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(checkpoint_path, 'w') as f:
-        json.dump(data, f, indent=2)
+def save_articles(output_path: Path, wal_path: Path):
+    """Save logged articles to JSON file, streaming them from the log."""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    count = dump_json_array(output_path, iter_logged_articles(wal_path))
+    logger.info(f"Saved {count} articles to {output_path}")
 
 
-def save_articles(output_path: Path, articles: list[dict]):
-    """Save articles to JSON file."""
+def save_prompt_inputs(output_path: Path, wal_path: Path):
+    """Save the slimmed article fields used to build answer prompts."""
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, 'w') as f:
-        json.dump(articles, f, indent=2)
-    logger.info(f"Saved {len(articles)} articles to {output_path}")
+    dump_json_array(output_path, (
+        {
+            'article_id': article['article_id'],
+            'title': article['title'],
+            'collection': article['collection'],
+            'content_md8k': article['content']['markdown'][:8000]
+        }
+        for article in iter_logged_articles(wal_path)
+    ))
+    logger.info(f"Saved prompt inputs to {output_path}")
+
+
+# Scraper used for article extraction inside each worker process
+_worker_scraper: Optional[Scraper] = None
+
+
+def _init_extract_worker(config: dict):
+    """Build the extraction worker's scraper once per process."""
+    global _worker_scraper
+    _worker_scraper = Scraper(config)
+
+
+def _extract_article(article_html: str, article_info: dict) -> dict:
+    return _worker_scraper.extract_article_content(article_html, article_info)
+
+
+async def fetch_with_limit(scraper: Scraper, sem: asyncio.Semaphore, session, url: str) -> Optional[str]:
+    """Fetch a page while holding a concurrency slot.
+    
+    Request rate is governed by the scraper's token bucket. Cache hits
+    return immediately without taking a slot.
+    """
+    cached = scraper.get_cached_page(url)
+    if cached is not None:
+        return cached
+    
+    async with sem:
+        return await scraper.fetch_page_async(session, url)
+
 
+async def fetch_collection(scraper: Scraper, sem: asyncio.Semaphore, session, collection: dict) -> list[dict]:
+    """Fetch a collection page and extract its article URLs."""
+    logger.info(f"Fetching collection: {collection['name']}")
+    collection_html = await fetch_with_limit(scraper, sem, session, collection['url'])
+    if not collection_html:
+        return []
+    return scraper.extract_articles_from_collection(collection_html, collection)
 
-def main():
+
+async def main():
     parser = argparse.ArgumentParser(description='Scrape Atom helpdesk articles')
     parser.add_argument('--limit', type=int, help='Limit number of articles to scrape (for testing)')
     parser.add_argument('--resume', action='store_true', help='Resume from checkpoint')
+    parser.add_argument('--no-cache', action='store_true', help='Always fetch pages over HTTP, bypassing the HTML cache')
+    parser.add_argument('--cache-ttl-hours', type=float, help='Maximum age of cached pages (default from config)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes for article extraction (1 extracts in-process)')
     args = parser.parse_args()
     
     config = load_config()
     base_path = Path(__file__).parent.parent
     output_path = base_path / config['paths']['raw_articles']
+    prompt_inputs_path = base_path / config['paths']['article_prompt_cache']
     checkpoint_path = base_path / config['paths']['checkpoint']
+    wal_path = base_path / config['paths']['articles_wal']
     
-    scraper = Scraper(config)
+    cache_dir = None if args.no_cache else base_path / config['scraping']['cache_dir']
+    scraper = Scraper(config, cache_dir=cache_dir, cache_ttl_hours=args.cache_ttl_hours)
     
-    # Load checkpoint if resuming
-    checkpoint = {}
-    scraped_articles = []
+    # Replay the article log if resuming. Scraped articles live only in the
+    # log; the final outputs are streamed from it so they are never all in memory.
     processed_article_ids = set()
+    collection_counts = Counter()
     
-    if args.resume:
-        checkpoint = load_checkpoint(checkpoint_path)
-        if checkpoint.get('phase') == 'scraping' and checkpoint.get('articles'):
-            scraped_articles = checkpoint['articles']
-            processed_article_ids = {a['article_id'] for a in scraped_articles}
-            logger.info(f"Resuming from checkpoint: {len(scraped_articles)} articles already scraped")
-    
-    # Step 1: Fetch homepage and extract collections
-    logger.info("Fetching homepage...")
-    homepage_html = scraper.fetch_page(config['scraping']['base_url'])
-    if not homepage_html:
-        logger.error("Failed to fetch homepage")
-        return 1
-    
-    collections = scraper.extract_collections(homepage_html)
-    logger.info(f"Found {len(collections)} collections")
+    if args.resume and wal_path.exists():
+        for article in iter_logged_articles(wal_path):
+            processed_article_ids.add(article['article_id'])
+            collection_counts[article['collection']] += 1
+        logger.info(f"Resuming from checkpoint: {len(processed_article_ids)} articles already scraped")
     
-    # Step 2: Extract all article URLs from each collection
-    all_articles = []
-    for collection in tqdm(collections, desc="Fetching collections"):
-        logger.info(f"Fetching collection: {collection['name']}")
-        collection_html = scraper.fetch_page(collection['url'])
-        if collection_html:
-            articles = scraper.extract_articles_from_collection(collection_html, collection)
-            all_articles.extend(articles)
+    sem = asyncio.Semaphore(scraper.concurrency)
     
-    logger.info(f"Found {len(all_articles)} total articles across all collections")
-    
-    # Remove duplicates (same article can appear in multiple collections)
-    seen_ids = set()
-    unique_articles = []
-    for article in all_articles:
-        if article['id'] not in seen_ids:
-            seen_ids.add(article['id'])
-            unique_articles.append(article)
-    
-    logger.info(f"Found {len(unique_articles)} unique articles after deduplication")
-    
-    # Apply limit if specified
-    articles_to_scrape = unique_articles
-    if args.limit:
-        articles_to_scrape = unique_articles[:args.limit]
-        logger.info(f"Limiting to {args.limit} articles for testing")
-    
-    # Step 3: Scrape each article
-    for article_info in tqdm(articles_to_scrape, desc="Scraping articles"):
-        # Skip if already processed
-        if article_info['id'] in processed_article_ids:
-            continue
+    async with scraper.create_async_session() as session:
+        # Step 1: Fetch homepage and extract collections
+        logger.info("Fetching homepage...")
+        homepage_html = await scraper.fetch_page_async(session, config['scraping']['base_url'])
+        if not homepage_html:
+            logger.error("Failed to fetch homepage")
+            return 1
+        
+        collections = scraper.extract_collections(homepage_html)
+        logger.info(f"Found {len(collections)} collections")
         
-        logger.debug(f"Scraping article: {article_info['title']}")
-        article_html = scraper.fetch_page(article_info['url'])
+        # Step 2: Extract all article URLs from each collection concurrently
+        collection_articles = await asyncio.gather(
+            *[fetch_collection(scraper, sem, session, c) for c in collections]
+        )
+        all_articles = [article for articles in collection_articles for article in articles]
         
-        if article_html:
-            try:
-                article_data = scraper.extract_article_content(article_html, article_info)
-                scraped_articles.append(article_data)
-                processed_article_ids.add(article_info['id'])
-                
-                # Save checkpoint every 10 articles
-                if len(scraped_articles) % 10 == 0:
-                    save_checkpoint(checkpoint_path, {
-                        'phase': 'scraping',
-                        'last_updated': datetime.now().isoformat(),
-                        'articles_scraped': len(scraped_articles),
-                        'articles_total': len(articles_to_scrape),
-                        'articles': scraped_articles
-                    })
-            except Exception as e:
-                logger.error(f"Error extracting article {article_info['id']}: {e}")
-        else:
-            logger.warning(f"Failed to fetch article: {article_info['url']}")
+        logger.info(f"Found {len(all_articles)} total articles across all collections")
+        
+        # Remove duplicates (same article can appear in multiple collections);
+        # the first listing wins, keeping its collection label
+        unique_by_id = {}
+        for article in all_articles:
+            unique_by_id.setdefault(article['id'], article)
+        unique_articles = list(unique_by_id.values())
+        
+        logger.info(f"Found {len(unique_articles)} unique articles after deduplication")
+        
+        # Apply limit if specified
+        articles_to_scrape = unique_articles
+        if args.limit:
+            articles_to_scrape = unique_articles[:args.limit]
+            logger.info(f"Limiting to {args.limit} articles for testing")
+        
+        # Step 3: Scrape articles concurrently, skipping those already processed
+        pending = [a for a in articles_to_scrape if a['id'] not in processed_article_ids]
+        checkpoint_lock = asyncio.Lock()
+        progress = tqdm(
+            total=len(articles_to_scrape),
+            initial=len(articles_to_scrape) - len(pending),
+            desc="Scraping articles"
+        )
+        
+        # Parsing and markdown conversion are CPU-bound, so run them in worker
+        # processes while the event loop keeps downloading
+        loop = asyncio.get_running_loop()
+        executor = None
+        if args.workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=args.workers, initializer=_init_extract_worker, initargs=(config,)
+            )
+        
+        async def scrape_article(article_info: dict):
+            logger.debug(f"Scraping article: {article_info['title']}")
+            article_html = await fetch_with_limit(scraper, sem, session, article_info['url'])
+            
+            if article_html:
+                try:
+                    if executor is None:
+                        article_data = scraper.extract_article_content(article_html, article_info)
+                    else:
+                        article_data = await loop.run_in_executor(
+                            executor, _extract_article, article_html, article_info
+                        )
+                except Exception as e:
+                    logger.error(f"Error extracting article {article_info['id']}: {e}")
+                else:
+                    async with checkpoint_lock:
+                        processed_article_ids.add(article_info['id'])
+                        collection_counts[article_data['collection']] += 1
+                        wal.append(article_data)
+                        
+                        # Save checkpoint summary every 10 articles
+                        if len(processed_article_ids) % 10 == 0:
+                            save_checkpoint(checkpoint_path, {
+                                'phase': 'scraping',
+                                'last_updated': datetime.now().isoformat(),
+                                'articles_scraped': len(processed_article_ids),
+                                'articles_total': len(articles_to_scrape)
+                            })
+            else:
+                logger.warning(f"Failed to fetch article: {article_info['url']}")
+            progress.update(1)
+        
+        # Gather in chunks so only a bounded number of coroutines exist at once.
+        # Each scraped article is appended to the log; a fresh run starts a new log.
+        try:
+            with JsonlAppender(wal_path, truncate=not args.resume) as wal:
+                for start in range(0, len(pending), 50):
+                    await asyncio.gather(*[scrape_article(a) for a in pending[start:start + 50]])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        progress.close()
     
     # Save final output
-    save_articles(output_path, scraped_articles)
+    save_articles(output_path, wal_path)
+    save_prompt_inputs(prompt_inputs_path, wal_path)
     
     # Update checkpoint
     save_checkpoint(checkpoint_path, {
         'phase': 'scraping_complete',
         'last_updated': datetime.now().isoformat(),
-        'articles_scraped': len(scraped_articles),
+        'articles_scraped': len(processed_article_ids),
         'articles_total': len(articles_to_scrape)
     })
     
@@ -170,21 +256,16 @@ def main():
     print("SCRAPING COMPLETE")
     print(f"{'='*50}")
     print(f"Collections processed: {len(collections)}")
-    print(f"Articles scraped: {len(scraped_articles)}")
+    print(f"Articles scraped: {len(processed_article_ids)}")
     print(f"Output file: {output_path}")
     
     # Collection breakdown
-    collection_counts = {}
-    for article in scraped_articles:
-        col = article['collection']
-        collection_counts[col] = collection_counts.get(col, 0) + 1
-    
     print(f"\nArticles by collection:")
-    for col, count in sorted(collection_counts.items(), key=lambda x: -x[1]):
+    for col, count in collection_counts.most_common():
         print(f"  - {col}: {count}")
     
     return 0
 
 
 if __name__ == '__main__':
-    sys.exit(main())
+    sys.exit(asyncio.run(main()))
@@ -8,18 +8,19 @@ Outputs: data/intermediate/questions.json
 
 import os
 import sys
-import json
 import logging
 import argparse
 from pathlib import Path
+from itertools import islice
 from datetime import datetime
 
-import yaml
 from tqdm import tqdm
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from utils.config import load_config
 from utils.llm_client import LLMClient, load_prompt, format_prompt
+from utils.jsonio import dump_json, iter_json_array, iter_jsonl, JsonlAppender
 from utils.validators import parse_questions_json
 
 logging.basicConfig(
@@ -33,23 +34,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def load_config() -> dict:
-    config_path = Path(__file__).parent.parent / 'config' / 'config.yaml'
-    with open(config_path) as f:
-        return yaml.safe_load(f)
-
-
-def load_checkpoint(checkpoint_path: Path) -> dict:
-    if checkpoint_path.exists():
-        with open(checkpoint_path) as f:
-            return json.load(f)
-    return {}
-
-
 def save_checkpoint(checkpoint_path: Path, data: dict):
     checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(checkpoint_path, 'w') as f:
-        json.dump(data, f, indent=2)
+    dump_json(checkpoint_path, data)
 
 
 def main():
@@ -65,29 +52,30 @@ def main():
     articles_path = base_path / config['paths']['raw_articles']
     output_path = base_path / config['paths']['questions']
     checkpoint_path = base_path / config['paths']['checkpoint']
+    wal_path = base_path / config['paths']['questions_wal']
     prompt_path = base_path / 'prompts' / 'question_generation.txt'
     
-    # Load articles
-    with open(articles_path) as f:
-        articles = json.load(f)
+    # Replay the question log
+    existing_questions = {}
+    if args.resume and wal_path.exists():
+        existing_questions = {q['article_id']: q for q in iter_jsonl(wal_path)}
+        logger.info(f"Resuming: {len(existing_questions)} articles already processed")
     
-    logger.info(f"Loaded {len(articles)} articles")
+    # Stream articles, keeping only those not yet processed
+    articles = iter_json_array(articles_path)
     
     # Apply limit
     if args.limit:
-        articles = articles[:args.limit]
+        articles = islice(articles, args.limit)
         logger.info(f"Limiting to {args.limit} articles")
     
-    # Load checkpoint
-    existing_questions = {}
-    if args.resume:
-        checkpoint = load_checkpoint(checkpoint_path)
-        if checkpoint.get('phase') == 'questions' and checkpoint.get('questions'):
-            existing_questions = checkpoint['questions']
-            logger.info(f"Resuming: {len(existing_questions)} articles already processed")
-    
-    # Filter articles not yet processed
-    articles_to_process = [a for a in articles if a['article_id'] not in existing_questions]
+    # Keep only the truncated markdown the prompts need, dropping the rest of
+    # each article's content (HTML, plain text, sections) as it is streamed in
+    articles_to_process = []
+    for article in articles:
+        if article['article_id'] not in existing_questions:
+            article['_md8k'] = article.pop('content')['markdown'][:8000]
+            articles_to_process.append(article)
     logger.info(f"{len(articles_to_process)} articles to process")
     
     if not articles_to_process:
@@ -104,71 +92,71 @@ def main():
     
     if args.sync:
         # Synchronous mode (for testing)
-        for article in tqdm(articles_to_process, desc="Generating questions"):
-            prompt = format_prompt(
-                prompt_template,
-                title=article['title'],
-                collection=article['collection'],
-                description=article.get('description', ''),
-                content=article['content']['markdown'][:8000]  # Limit content size
-            )
-            
-            response = client.generate_single(
-                prompt,
-                temperature=config['generation']['temperature_questions'],
-                max_tokens=config['generation']['max_tokens_questions']
-            )
-            
-            if response:
-                questions = parse_questions_json(response)
-                all_questions[article['article_id']] = {
-                    'article_id': article['article_id'],
-                    'title': article['title'],
-                    'collection': article['collection'],
-                    'questions': questions
-                }
+        with JsonlAppender(wal_path, truncate=not args.resume) as wal:
+            for article in tqdm(articles_to_process, desc="Generating questions"):
+                prompt = format_prompt(
+                    prompt_template,
+                    title=article['title'],
+                    collection=article['collection'],
+                    description=article.get('description', ''),
+                    content=article['_md8k']
+                )
                 
-                # Save checkpoint
-                if len(all_questions) % 5 == 0:
-                    save_checkpoint(checkpoint_path, {
-                        'phase': 'questions',
-                        'last_updated': datetime.now().isoformat(),
-                        'processed': len(all_questions),
-                        'questions': all_questions
-                    })
+                response = client.generate_single(
+                    prompt,
+                    temperature=config['generation']['temperature_questions'],
+                    max_tokens=config['generation']['max_tokens_questions']
+                )
+                
+                if response:
+                    questions = parse_questions_json(response)
+                    entry = {
+                        'article_id': article['article_id'],
+                        'title': article['title'],
+                        'collection': article['collection'],
+                        'questions': questions
+                    }
+                    all_questions[article['article_id']] = entry
+                    wal.append(entry)
+                    
+                    # Save checkpoint summary
+                    if len(all_questions) % 5 == 0:
+                        save_checkpoint(checkpoint_path, {
+                            'phase': 'questions',
+                            'last_updated': datetime.now().isoformat(),
+                            'processed': len(all_questions)
+                        })
     else:
-        # Batch mode
-        logger.info("Preparing batch requests...")
-        batch_requests = []
-        
-        for article in articles_to_process:
-            prompt = format_prompt(
-                prompt_template,
-                title=article['title'],
-                collection=article['collection'],
-                description=article.get('description', ''),
-                content=article['content']['markdown'][:8000]
-            )
-            
-            batch_requests.append({
-                'custom_id': article['article_id'],
-                'prompt': prompt,
-                'temperature': config['generation']['temperature_questions'],
-                'max_tokens': config['generation']['max_tokens_questions']
-            })
+        # Batch mode: requests are generated lazily and streamed into the batch file
+        def batch_requests():
+            for article in articles_to_process:
+                prompt = format_prompt(
+                    prompt_template,
+                    title=article['title'],
+                    collection=article['collection'],
+                    description=article.get('description', ''),
+                    content=article['_md8k']
+                )
+                
+                yield {
+                    'custom_id': article['article_id'],
+                    'prompt': prompt,
+                    'temperature': config['generation']['temperature_questions'],
+                    'max_tokens': config['generation']['max_tokens_questions']
+                }
         
         # Run batch
         batch_file = base_path / 'data' / 'intermediate' / 'questions_batch.jsonl'
-        logger.info(f"Submitting batch with {len(batch_requests)} requests...")
+        logger.info(f"Submitting batch with {len(articles_to_process)} requests...")
         
         results = client.run_batch(
-            batch_requests,
+            batch_requests(),
             batch_file,
             description="Question generation for Atom helpdesk"
         )
         
         # Process results
-        article_map = {a['article_id']: a for a in articles}
+        article_map = {a['article_id']: a for a in articles_to_process}
         
         for result in results:
             article_id = result['custom_id']
@@ -192,8 +180,7 @@ def main():
     
     # Save output
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, 'w') as f:
-        json.dump(all_questions, f, indent=2)
+    dump_json(output_path, all_questions)
     
     # Update checkpoint
     save_checkpoint(checkpoint_path, {
@@ -2,24 +2,25 @@
 """
 Phase 3: Generate answers for each question using OpenAI Batch API.
 
-Inputs: data/raw/articles.json, data/intermediate/questions.json
+Inputs: data/intermediate/article_prompt_cache.json (or data/raw/articles.json), data/intermediate/questions.json
 Outputs: data/intermediate/qa_pairs.json
 """
 
 import os
 import sys
-import json
 import logging
 import argparse
 from pathlib import Path
 from datetime import datetime
+from collections import Counter
 
-import yaml
 from tqdm import tqdm
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from utils.config import load_config
 from utils.llm_client import LLMClient, load_prompt, format_prompt
+from utils.jsonio import load_json, dump_json, iter_json_array, iter_jsonl, JsonlAppender
 
 logging.basicConfig(
     level=logging.INFO,
@@ -32,23 +33,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def load_config() -> dict:
-    config_path = Path(__file__).parent.parent / 'config' / 'config.yaml'
-    with open(config_path) as f:
-        return yaml.safe_load(f)
-
-
-def load_checkpoint(checkpoint_path: Path) -> dict:
-    if checkpoint_path.exists():
-        with open(checkpoint_path) as f:
-            return json.load(f)
-    return {}
-
-
 def save_checkpoint(checkpoint_path: Path, data: dict):
     checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(checkpoint_path, 'w') as f:
-        json.dump(data, f, indent=2)
+    dump_json(checkpoint_path, data)
 
 
 def main():
@@ -61,20 +48,32 @@ def main():
     config = load_config()
     base_path = Path(__file__).parent.parent
     
-    articles_path = base_path / config['paths']['raw_articles']
+    prompt_inputs_path = base_path / config['paths']['article_prompt_cache']
     questions_path = base_path / config['paths']['questions']
     output_path = base_path / config['paths']['qa_pairs']
     checkpoint_path = base_path / config['paths']['checkpoint']
+    wal_path = base_path / config['paths']['answers_wal']
     prompt_path = base_path / 'prompts' / 'answer_generation.txt'
     
-    # Load articles
-    with open(articles_path) as f:
-        articles = json.load(f)
-    article_map = {a['article_id']: a for a in articles}
+    # Load the slimmed article prompt inputs written by 01_scrape.py, or build
+    # them from the full articles if they predate it
+    if prompt_inputs_path.exists():
+        article_map = {a['article_id']: a for a in iter_json_array(prompt_inputs_path)}
+    else:
+        articles_path = base_path / config['paths']['raw_articles']
+        logger.info(f"Article prompt inputs not found, building them from {articles_path}")
+        article_map = {
+            article['article_id']: {
+                'article_id': article['article_id'],
+                'title': article['title'],
+                'collection': article['collection'],
+                'content_md8k': article['content']['markdown'][:8000]
+            }
+            for article in iter_json_array(articles_path)
+        }
     
     # Load questions
-    with open(questions_path) as f:
-        questions_data = json.load(f)
+    questions_data = load_json(questions_path)
     
     logger.info(f"Loaded {len(questions_data)} articles with questions")
     
@@ -83,7 +82,7 @@ def main():
     for article_id, data in questions_data.items():
         article = article_map.get(article_id)
         if not article:
-            logger.warning(f"Article {article_id} not found in articles.json")
+            logger.warning(f"Article {article_id} not found in article prompt inputs")
             continue
         
         for i, q in enumerate(data['questions']):
@@ -102,13 +101,11 @@ def main():
         qa_items = qa_items[:args.limit]
         logger.info(f"Limiting to {args.limit} Q&A pairs")
     
-    # Load checkpoint
+    # Replay the answer log
     existing_answers = {}
-    if args.resume:
-        checkpoint = load_checkpoint(checkpoint_path)
-        if checkpoint.get('phase') == 'answers' and checkpoint.get('qa_pairs'):
-            existing_answers = {qa['qa_id']: qa for qa in checkpoint['qa_pairs']}
-            logger.info(f"Resuming: {len(existing_answers)} Q&A pairs already processed")
+    if args.resume and wal_path.exists():
+        existing_answers = {qa['qa_id']: qa for qa in iter_jsonl(wal_path)}
+        logger.info(f"Resuming: {len(existing_answers)} Q&A pairs already processed")
     
     # Filter items not yet processed
     items_to_process = [item for item in qa_items if item['qa_id'] not in existing_answers]
@@ -128,72 +125,73 @@ def main():
     
     if args.sync:
         # Synchronous mode (for testing)
-        for item in tqdm(items_to_process, desc="Generating answers"):
-            article = item['article']
-            prompt = format_prompt(
-                prompt_template,
-                title=article['title'],
-                collection=article['collection'],
-                content=article['content']['markdown'][:8000],
-                question=item['question']
-            )
-            
-            response = client.generate_single(
-                prompt,
-                temperature=config['generation']['temperature_answers'],
-                max_tokens=config['generation']['max_tokens_answers']
-            )
-            
-            if response:
-                qa_pair = {
-                    'qa_id': item['qa_id'],
-                    'article_id': item['article_id'],
-                    'question': item['question'],
-                    'question_type': item['question_type'],
-                    'answer': response.strip(),
-                    'collection': article['collection'],
-                    'article_title': article['title']
-                }
-                all_qa_pairs.append(qa_pair)
+        with JsonlAppender(wal_path, truncate=not args.resume) as wal:
+            for item in tqdm(items_to_process, desc="Generating answers"):
+                article = item['article']
+                prompt = format_prompt(
+                    prompt_template,
+                    title=article['title'],
+                    collection=article['collection'],
+                    content=article['content_md8k'],
+                    question=item['question']
+                )
+                
+                response = client.generate_single(
+                    prompt,
+                    temperature=config['generation']['temperature_answers'],
+                    max_tokens=config['generation']['max_tokens_answers']
+                )
                 
-                # Save checkpoint
-                if len(all_qa_pairs) % 10 == 0:
-                    save_checkpoint(checkpoint_path, {
-                        'phase': 'answers',
-                        'last_updated': datetime.now().isoformat(),
-                        'processed': len(all_qa_pairs),
-                        'qa_pairs': all_qa_pairs
-                    })
+                if response:
+                    qa_pair = {
+                        'qa_id': item['qa_id'],
+                        'article_id': item['article_id'],
+                        'question': item['question'],
+                        'question_type': item['question_type'],
+                        'answer': response.strip(),
+                        'collection': article['collection'],
+                        'article_title': article['title']
+                    }
+                    all_qa_pairs.append(qa_pair)
+                    wal.append(qa_pair)
+                    
+                    # Save checkpoint summary
+                    if len(all_qa_pairs) % 10 == 0:
+                        save_checkpoint(checkpoint_path, {
+                            'phase': 'answers',
+                            'last_updated': datetime.now().isoformat(),
+                            'processed': len(all_qa_pairs)
+                        })
     else:
-        # Batch mode
-        logger.info("Preparing batch requests...")
-        batch_requests = []
+        # Batch mode: requests are generated lazily and streamed into the batch file,
+        # filling item_map in the same pass
         item_map = {}
         
-        for item in items_to_process:
-            article = item['article']
-            prompt = format_prompt(
-                prompt_template,
-                title=article['title'],
-                collection=article['collection'],
-                content=article['content']['markdown'][:8000],
-                question=item['question']
-            )
-            
-            batch_requests.append({
-                'custom_id': item['qa_id'],
-                'prompt': prompt,
-                'temperature': config['generation']['temperature_answers'],
-                'max_tokens': config['generation']['max_tokens_answers']
-            })
-            item_map[item['qa_id']] = item
+        def batch_requests():
+            for item in items_to_process:
+                article = item['article']
+                prompt = format_prompt(
+                    prompt_template,
+                    title=article['title'],
+                    collection=article['collection'],
+                    content=article['content_md8k'],
+                    question=item['question']
+                )
+                
+                item_map[item['qa_id']] = item
+                yield {
+                    'custom_id': item['qa_id'],
+                    'prompt': prompt,
+                    'temperature': config['generation']['temperature_answers'],
+                    'max_tokens': config['generation']['max_tokens_answers']
+                }
         
         # Run batch
         batch_file = base_path / 'data' / 'intermediate' / 'answers_batch.jsonl'
-        logger.info(f"Submitting batch with {len(batch_requests)} requests...")
+        logger.info(f"Submitting batch with {len(items_to_process)} requests...")
         
         results = client.run_batch(
-            batch_requests,
+            batch_requests(),
             batch_file,
             description="Answer generation for Atom helpdesk"
         )
@@ -221,8 +219,7 @@ def main():
     
     # Save output
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, 'w') as f:
-        json.dump(all_qa_pairs, f, indent=2)
+    dump_json(output_path, all_qa_pairs)
     
     # Update checkpoint
     save_checkpoint(checkpoint_path, {
@@ -239,13 +236,10 @@ def main():
     print(f"Output file: {output_path}")
     
     # Question type breakdown
-    type_counts = {}
-    for qa in all_qa_pairs:
-        qt = qa.get('question_type', 'unknown')
-        type_counts[qt] = type_counts.get(qt, 0) + 1
+    type_counts = Counter(qa.get('question_type', 'unknown') for qa in all_qa_pairs)
     
     print(f"\nQuestion types:")
-    for qt, count in sorted(type_counts.items(), key=lambda x: -x[1]):
+    for qt, count in type_counts.most_common():
         print(f"  - {qt}: {count}")
     
     return 0
@@ -8,15 +8,20 @@ Outputs: data/output/training_data.jsonl, data/output/metadata.json
 
 import os
 import sys
-import json
 import logging
+import argparse
 from pathlib import Path
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
-import yaml
+import orjson
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from utils.config import load_config
+from utils.jsonio import dump_json, iter_json_array
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s [%(levelname)s] %(name)s: %(message)s'
@@ -24,39 +29,33 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def load_config() -> dict:
-    config_path = Path(__file__).parent.parent / 'config' / 'config.yaml'
-    with open(config_path) as f:
-        return yaml.safe_load(f)
-
-
 def get_system_prompt(collection: str, config: dict) -> str:
     """Get the appropriate system prompt for a collection."""
     prompt_key = config['collection_prompt_mapping'].get(collection, 'default')
     return config['system_prompts'].get(prompt_key, config['system_prompts']['default'])
 
 
-def format_as_messages(qa_pair: dict, system_prompt: str) -> dict:
-    """Format a Q&A pair as OpenAI messages structure."""
-    return {
-        "messages": [
-            {
-                "role": "system",
-                "content": system_prompt
-            },
-            {
-                "role": "user",
-                "content": qa_pair['question']
-            },
-            {
-                "role": "assistant",
-                "content": qa_pair['answer']
-            }
-        ]
-    }
+def encode_chunk(chunk: list[tuple[str, str, str]], prompt_map: dict[str, str], default_prompt: str) -> bytes:
+    """Encode (collection, question, answer) tuples as OpenAI messages JSONL lines."""
+    return b''.join(
+        orjson.dumps({
+            "messages": [
+                {"role": "system", "content": prompt_map.get(collection, default_prompt)},
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": answer}
+            ]
+        }) + b'\n'
+        for collection, question, answer in chunk
+    )
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Format Q&A pairs as fine-tuning JSONL')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes for encoding (1 encodes in-process)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Q&A pairs per encoding task')
+    args = parser.parse_args()
+    
     config = load_config()
     base_path = Path(__file__).parent.parent
     
@@ -64,50 +63,73 @@ def main():
     output_path = base_path / config['paths']['training_data']
     metadata_path = base_path / config['paths']['metadata']
     
-    # Load Q&A pairs
-    with open(qa_pairs_path) as f:
-        qa_pairs = json.load(f)
-    
-    logger.info(f"Loaded {len(qa_pairs)} Q&A pairs")
-    
-    # Format as JSONL
+    # Format as JSONL, streaming Q&A pairs from disk one at a time
     output_path.parent.mkdir(parents=True, exist_ok=True)
     
-    collection_counts = {}
-    question_type_counts = {}
+    total_examples = 0
+    collection_counts = Counter()
+    question_type_counts = Counter()
+    unique_article_ids: set[str] = set()
     total_answer_chars = 0
     
-    with open(output_path, 'w') as f:
-        for qa_pair in qa_pairs:
+    # System prompts are resolved once here and shipped to the workers;
+    # collections without a mapping fall back to the default prompt
+    prompt_map = {c: get_system_prompt(c, config) for c in config['collection_prompt_mapping']}
+    default_prompt = config['system_prompts']['default']
+    
+    def iter_chunks():
+        """Stream Q&A pairs into fixed-size chunks, tracking stats on the way."""
+        nonlocal total_examples, total_answer_chars
+        chunk = []
+        for qa_pair in iter_json_array(qa_pairs_path):
             collection = qa_pair.get('collection', '')
-            system_prompt = get_system_prompt(collection, config)
-            
-            formatted = format_as_messages(qa_pair, system_prompt)
-            f.write(json.dumps(formatted) + '\n')
+            chunk.append((collection, qa_pair['question'], qa_pair['answer']))
             
             # Track stats
-            collection_counts[collection] = collection_counts.get(collection, 0) + 1
-            qt = qa_pair.get('question_type', 'unknown')
-            question_type_counts[qt] = question_type_counts.get(qt, 0) + 1
+            total_examples += 1
+            collection_counts[collection] += 1
+            question_type_counts[qa_pair.get('question_type', 'unknown')] += 1
+            unique_article_ids.add(qa_pair['article_id'])
             total_answer_chars += len(qa_pair.get('answer', ''))
-    
-    logger.info(f"Wrote {len(qa_pairs)} examples to {output_path}")
+            
+            if len(chunk) == args.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    with open(output_path, 'wb') as f:
+        if args.workers > 1:
+            # Keep a bounded window of chunks in flight and write results in
+            # submission order so the output matches the input order
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                in_flight = deque()
+                for chunk in iter_chunks():
+                    in_flight.append(executor.submit(encode_chunk, chunk, prompt_map, default_prompt))
+                    if len(in_flight) >= 2 * args.workers:
+                        f.write(in_flight.popleft().result())
+                while in_flight:
+                    f.write(in_flight.popleft().result())
+        else:
+            for chunk in iter_chunks():
+                f.write(encode_chunk(chunk, prompt_map, default_prompt))
+    
+    logger.info(f"Wrote {total_examples} examples to {output_path}")
     
     # Calculate stats
-    avg_answer_length = total_answer_chars / len(qa_pairs) if qa_pairs else 0
+    avg_answer_length = total_answer_chars / total_examples if total_examples else 0
     
-    # Get unique articles
-    unique_articles = len(set(qa['article_id'] for qa in qa_pairs))
+    unique_articles = len(unique_article_ids)
     
     # Create metadata
     metadata = {
         "generated_at": datetime.now().isoformat(),
-        "total_examples": len(qa_pairs),
+        "total_examples": total_examples,
         "source_articles": unique_articles,
-        "avg_questions_per_article": len(qa_pairs) / unique_articles if unique_articles else 0,
+        "avg_questions_per_article": total_examples / unique_articles if unique_articles else 0,
         "collections_covered": [
             {"name": name, "examples": count}
-            for name, count in sorted(collection_counts.items(), key=lambda x: -x[1])
+            for name, count in collection_counts.most_common()
         ],
         "question_type_distribution": question_type_counts,
         "avg_answer_length_chars": round(avg_answer_length, 1),
@@ -115,8 +137,7 @@ def main():
         "validation_passed": None  # Will be set by quality check
     }
     
-    with open(metadata_path, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    dump_json(metadata_path, metadata)
     
     logger.info(f"Wrote metadata to {metadata_path}")
     
@@ -124,7 +145,7 @@ def main():
     print(f"\n{'='*50}")
     print("FORMATTING COMPLETE")
     print(f"{'='*50}")
-    print(f"Total examples: {len(qa_pairs)}")
+    print(f"Total examples: {total_examples}")
     print(f"Source articles: {unique_articles}")
     print(f"Avg questions per article: {metadata['avg_questions_per_article']:.1f}")
     print(f"Avg answer length: {avg_answer_length:.0f} chars")
@@ -133,11 +154,11 @@ def main():
     print(f"  - {metadata_path}")
     
     print(f"\nExamples by collection:")
-    for item in metadata['collections_covered'][:5]:
-        print(f"  - {item['name']}: {item['examples']}")
+    for name, count in collection_counts.most_common(5):
+        print(f"  - {name}: {count}")
     
     print(f"\nQuestion types:")
-    for qt, count in sorted(question_type_counts.items(), key=lambda x: -x[1]):
+    for qt, count in question_type_counts.most_common():
         print(f"  - {qt}: {count}")
     
     return 0
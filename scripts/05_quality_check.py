@@ -8,20 +8,29 @@ Outputs: data/output/final_training_data.jsonl, data/output/quality_report.json
 
 import os
 import sys
-import json
 import logging
 import random
+import argparse
+from collections import Counter
+from multiprocessing import Pool
 from pathlib import Path
 from datetime import datetime
 
-import yaml
+import numpy as np
+import orjson
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from utils.config import load_config
+from utils.jsonio import load_json, dump_json, iter_json_array, open_writer
+from utils.llm_client import LLMClient
 from utils.validators import (
     validate_json_structure,
     validate_content_length,
+    content_length_mask,
     validate_answer_grounding,
+    extract_numbers,
+    cosine_similarities,
     deduplicate_qa_pairs
 )
 
@@ -32,13 +41,39 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def load_config() -> dict:
-    config_path = Path(__file__).parent.parent / 'config' / 'config.yaml'
-    with open(config_path) as f:
-        return yaml.safe_load(f)
+def _check_jsonl_range(task: tuple[str, int, int]) -> tuple[int, list[tuple[int, str]]]:
+    """Validate the lines that start inside the byte range [start, end)."""
+    path, start, end = task
+    count = 0
+    errors = []
+    with open(path, 'rb', buffering=1 << 20) as f:
+        if start:
+            # The line straddling the boundary belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            valid, error = validate_json_structure(line)
+            if not valid:
+                errors.append((count, error))
+            count += 1
+    return count, errors
+
+
+def jsonl_ranges(path: Path, parts: int) -> list[tuple[str, int, int]]:
+    size = path.stat().st_size
+    step = max(1, -(-size // parts))
+    return [(str(path), start, min(start + step, size)) for start in range(0, size, step)]
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Validate and filter training data')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of validation worker processes')
+    args = parser.parse_args()
+    
     config = load_config()
     base_path = Path(__file__).parent.parent
     
@@ -50,12 +85,9 @@ def main():
     metadata_path = base_path / config['paths']['metadata']
     
     # Load data
-    with open(qa_pairs_path) as f:
-        qa_pairs = json.load(f)
-    
-    with open(articles_path) as f:
-        articles = json.load(f)
-    article_map = {a['article_id']: a for a in articles}
+    qa_pairs = load_json(qa_pairs_path)
+    # Only the plain text is needed; stream the articles so the rest is never kept
+    article_text = {a['article_id']: a['content']['plain_text'] for a in iter_json_array(articles_path)}
     
     logger.info(f"Loaded {len(qa_pairs)} Q&A pairs for validation")
     
@@ -68,30 +100,39 @@ def main():
         'grounding_check': {'passed': 0, 'failed': 0, 'issues': []}
     }
     
-    # Validate JSONL format
-    with open(training_path) as f:
-        for i, line in enumerate(f):
-            valid, error = validate_json_structure(line)
-            if valid:
-                results['json_validity']['passed'] += 1
-                results['schema_compliance']['passed'] += 1
-            else:
-                results['json_validity']['failed'] += 1
-                results['schema_compliance']['failed'] += 1
-                logger.warning(f"Line {i}: {error}")
-    
-    # Validate content lengths
-    for qa in qa_pairs:
-        valid, error = validate_content_length(
-            qa['question'],
-            qa['answer'],
-            config
-        )
-        if valid:
-            results['content_length']['passed'] += 1
-        else:
-            results['content_length']['failed'] += 1
-            logger.debug(f"Content length issue: {error}")
+    # Validate content lengths once as array comparisons; the mask also drives filtering below
+    length_ok = content_length_mask(
+        np.fromiter((len(qa['question']) for qa in qa_pairs), dtype=np.int64, count=len(qa_pairs)),
+        np.fromiter((len(qa['answer']) for qa in qa_pairs), dtype=np.int64, count=len(qa_pairs)),
+        config
+    )
+    failed_indices = np.flatnonzero(~length_ok)
+    failed_qa_ids = {qa_pairs[i]['qa_id'] for i in failed_indices}
+    results['content_length']['failed'] = len(failed_indices)
+    results['content_length']['passed'] = len(qa_pairs) - len(failed_indices)
+    if logger.isEnabledFor(logging.DEBUG):
+        for i in failed_indices:
+            qa = qa_pairs[i]
+            logger.debug(f"Content length issue: {validate_content_length(qa['question'], qa['answer'], config)[1]}")
+    
+    # Validate JSONL format; with several workers each parses its own byte
+    # range of the file in a separate process
+    workers = max(1, args.workers)
+    ranges = jsonl_ranges(training_path, workers)
+    if workers > 1:
+        with Pool(workers) as pool:
+            range_results = list(pool.imap(_check_jsonl_range, ranges))
+    else:
+        range_results = [_check_jsonl_range(task) for task in ranges]
+    
+    line_offset = 0
+    for count, errors in range_results:
+        for i, error in errors:
+            logger.warning(f"Line {line_offset + i}: {error}")
+        line_offset += count
+        results['json_validity']['passed'] += count - len(errors)
+        results['json_validity']['failed'] += len(errors)
+    results['schema_compliance'] = dict(results['json_validity'])
     
     # Check grounding on sample
     sample_rate = config['validation']['semantic_sample_rate']
@@ -100,34 +141,67 @@ def main():
     
     logger.info(f"Checking grounding on {len(sample)} samples")
     
-    for qa in sample:
-        article = article_map.get(qa['article_id'])
-        if article:
-            article_content = article['content']['plain_text']
-            is_grounded, issues = validate_answer_grounding(qa['answer'], article_content)
-            
-            if is_grounded:
-                results['grounding_check']['passed'] += 1
-            else:
-                results['grounding_check']['failed'] += 1
-                results['grounding_check']['issues'].append({
-                    'qa_id': qa['qa_id'],
-                    'issues': issues
-                })
-    
-    # Deduplicate
-    deduped, dedup_stats = deduplicate_qa_pairs(qa_pairs, config)
-    
-    # Filter out failed items
-    failed_qa_ids = set()
-    
-    # Mark items that failed content length
-    for qa in qa_pairs:
-        valid, _ = validate_content_length(qa['question'], qa['answer'], config)
-        if not valid:
-            failed_qa_ids.add(qa['qa_id'])
-    
-    # Filter deduped list
+    # Scan each sampled article for numbers once, however many answers cite it.
+    # What remains per answer is cheap, so it runs in-process.
+    grounded_sample = [qa for qa in sample if qa['article_id'] in article_text]
+    article_numbers = {}
+    for qa in grounded_sample:
+        if qa['article_id'] not in article_numbers:
+            article_numbers[qa['article_id']] = extract_numbers(article_text[qa['article_id']])
+    grounding = [
+        (qa['qa_id'], *validate_answer_grounding(qa['answer'], article_numbers=article_numbers[qa['article_id']]))
+        for qa in grounded_sample
+    ]
+    
+    # Optionally also flag answers that are semantically far from their article
+    if config['validation'].get('embedding_grounding') and grounded_sample:
+        # Blank texts can't be embedded; each cited article is embedded once
+        embed_indices = [
+            i for i, qa in enumerate(grounded_sample)
+            if qa['answer'].strip() and article_text[qa['article_id']].strip()
+        ]
+        article_ids = list(dict.fromkeys(grounded_sample[i]['article_id'] for i in embed_indices))
+        vectors = LLMClient(config).embed(
+            [grounded_sample[i]['answer'] for i in embed_indices] +
+            [article_text[article_id][:4000] for article_id in article_ids]
+        )
+        article_rows = {article_id: len(embed_indices) + j for j, article_id in enumerate(article_ids)}
+        similarities = cosine_similarities(
+            vectors[:len(embed_indices)],
+            vectors[[article_rows[grounded_sample[i]['article_id']] for i in embed_indices]]
+        )
+        min_similarity = config['validation']['grounding_similarity_threshold']
+        for i, similarity in zip(embed_indices, similarities):
+            if similarity < min_similarity:
+                qa_id, _, issues = grounding[i]
+                grounding[i] = (qa_id, False, issues + [f"low similarity: {similarity:.2f}"])
+    
+    grounding_counts = Counter()
+    for qa_id, is_grounded, issues in grounding:
+        grounding_counts['passed' if is_grounded else 'failed'] += 1
+        if not is_grounded:
+            results['grounding_check']['issues'].append({
+                'qa_id': qa_id,
+                'issues': issues
+            })
+    results['grounding_check']['passed'] = grounding_counts['passed']
+    results['grounding_check']['failed'] = grounding_counts['failed']
+    
+    # Deduplicate, optionally narrowing near-duplicate checks with embeddings
+    embeddings = None
+    if config['validation'].get('embedding_dedup'):
+        batch_file = base_path / 'data' / 'intermediate' / 'embeddings_batch.jsonl'
+        embeddings = LLMClient(config).embed_batch(
+            [qa['question'] for qa in qa_pairs],
+            batch_file,
+            "Question embeddings for deduplication"
+        )
+        if embeddings is None:
+            logger.warning("Embedding batch failed, falling back to pairwise near-duplicate checks")
+    
+    deduped, dedup_stats = deduplicate_qa_pairs(qa_pairs, config, embeddings)
+    
+    # Filter deduped list, dropping items that failed content length
     final_pairs = [qa for qa in deduped if qa['qa_id'] not in failed_qa_ids]
     
     logger.info(f"Final dataset: {len(final_pairs)} examples")
@@ -135,20 +209,31 @@ def main():
     # Write final output
     output_path.parent.mkdir(parents=True, exist_ok=True)
     
-    with open(output_path, 'w') as f:
+    # Resolve each collection's system prompt once rather than per pair
+    default_prompt = config['system_prompts']['default']
+    prompt_by_collection = {
+        collection: config['system_prompts'].get(
+            config['collection_prompt_mapping'].get(collection, 'default'), default_prompt
+        )
+        for collection in {qa.get('collection', '') for qa in final_pairs}
+    }
+    
+    # Encode into a buffer and write it out in ~1 MB blocks (compressed for a .zst path)
+    with open_writer(output_path) as f:
+        buf = bytearray()
         for qa in final_pairs:
-            collection = qa.get('collection', '')
-            prompt_key = config['collection_prompt_mapping'].get(collection, 'default')
-            system_prompt = config['system_prompts'].get(prompt_key, config['system_prompts']['default'])
-            
             formatted = {
                 "messages": [
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": prompt_by_collection[qa.get('collection', '')]},
                     {"role": "user", "content": qa['question']},
                     {"role": "assistant", "content": qa['answer']}
                 ]
             }
-            f.write(json.dumps(formatted) + '\n')
+            buf += orjson.dumps(formatted, option=orjson.OPT_APPEND_NEWLINE)
+            if len(buf) >= 1 << 20:
+                f.write(buf)
+                buf.clear()
+        f.write(buf)
     
     # Calculate rates
     grounding_pass_rate = (
@@ -195,17 +280,14 @@ def main():
     if not report['recommendations']:
         report['recommendations'].append("All checks passed. Dataset is ready for fine-tuning.")
     
-    with open(report_path, 'w') as f:
-        json.dump(report, f, indent=2)
+    dump_json(report_path, report)
     
     # Update metadata
     if metadata_path.exists():
-        with open(metadata_path) as f:
-            metadata = json.load(f)
+        metadata = load_json(metadata_path)
         metadata['validation_passed'] = grounding_pass_rate >= 0.95
         metadata['final_examples'] = len(final_pairs)
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        dump_json(metadata_path, metadata)
     
     # Print summary
     print(f"\n{'='*50}")
@@ -12,14 +12,16 @@ import json
 import time
 import logging
 import argparse
+import tempfile
 from pathlib import Path
 
-import yaml
 from dotenv import load_dotenv
 from openai import OpenAI
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from utils.config import load_config
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s [%(levelname)s] %(name)s: %(message)s'
@@ -27,12 +29,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def load_config() -> dict:
-    config_path = Path(__file__).parent.parent / 'config' / 'config.yaml'
-    with open(config_path) as f:
-        return yaml.safe_load(f)
-
-
 def setup_client():
     env_path = Path(__file__).parent.parent / '.env'
     load_dotenv(dotenv_path=env_path)
@@ -43,7 +39,15 @@ def setup_client():
     return OpenAI(api_key=api_key)
 
 
-def wait_for_file_processing(client, file_id):
+def decompress_training_file(path):
+    """Decompress a .zst training file into a temporary .jsonl for upload."""
+    import zstandard
+    with open(path, 'rb') as src, tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False) as dst:
+        zstandard.ZstdDecompressor().copy_stream(src, dst)
+    return Path(dst.name)
+
+
+def wait_for_file_processing(client, file_id, poll_interval=1, max_poll_interval=30):
     logger.info(f"Waiting for file {file_id} to be processed...")
     while True:
         file_obj = client.files.retrieve(file_id)
@@ -53,10 +57,11 @@ def wait_for_file_processing(client, file_id):
         elif file_obj.status == 'error':
             logger.error(f"File processing failed: {file_obj.status_details}")
             return False
-        time.sleep(5)
+        time.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, max_poll_interval)
 
 
-def wait_for_job_completion(client, job_id, poll_interval=30):
+def wait_for_job_completion(client, job_id, poll_interval=30, max_poll_interval=300):
     logger.info(f"Monitoring fine-tuning job {job_id}...")
     
     start_time = time.time()
@@ -75,7 +80,9 @@ def wait_for_job_completion(client, job_id, poll_interval=30):
             
         # Log metrics if available (could be enhanced to show loss/accuracy)
         
+        # Back off between checks; jobs usually run for a long time
         time.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, max_poll_interval)
 
 
 def main():
@@ -104,8 +111,13 @@ def main():
         logger.info("[DRY RUN] Would upload file here")
         file_id = "file-dummy-id"
     else:
+        # The API expects plain JSONL, so compressed output is expanded first
+        upload_path = training_file_path
         try:
-            with open(training_file_path, "rb") as f:
+            if training_file_path.suffix == '.zst':
+                upload_path = decompress_training_file(training_file_path)
+            
+            with open(upload_path, "rb") as f:
                 response = client.files.create(
                     file=f,
                     purpose="fine-tune"
@@ -119,6 +131,9 @@ def main():
         except Exception as e:
             logger.error(f"Failed to upload file: {e}")
             return 1
+        finally:
+            if upload_path != training_file_path:
+                upload_path.unlink(missing_ok=True)
 
     # 3. Create Fine-tuning Job
     ft_config = config['finetuning']
@@ -157,7 +172,11 @@ def main():
         return 1
         
     # 4. Monitor Job
-    final_job = wait_for_job_completion(client, job_id, config['finetuning']['poll_interval_seconds'])
+    final_job = wait_for_job_completion(
+        client, job_id,
+        config['finetuning']['poll_interval_seconds'],
+        config['finetuning'].get('max_poll_interval_seconds', 300)
+    )
     
     # Save final job details
     with open(job_output_path, 'w') as f:
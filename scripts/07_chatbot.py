@@ -10,25 +10,21 @@ import sys
 import json
 import logging
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import yaml
 from dotenv import load_dotenv
 from openai import OpenAI
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from utils.config import load_config
+
 # Configure logging to hide HTTP requests
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
 
-def load_config() -> dict:
-    config_path = Path(__file__).parent.parent / 'config' / 'config.yaml'
-    with open(config_path) as f:
-        return yaml.safe_load(f)
-
-
 def setup_client():
     env_path = Path(__file__).parent.parent / '.env'
     load_dotenv(dotenv_path=env_path)
@@ -48,6 +44,23 @@ def load_model_id(config):
         return data.get('model_id')
 
 
+def summarize_history(client, model, messages):
+    """Condense earlier turns into a short note to carry forward."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    response = client.chat.completions.create(
+        model=model,
+        messages=[{
+            "role": "user",
+            "content": "Summarize this customer support conversation in a few sentences. "
+                       "Keep any specifics the customer gave (names, domains, amounts, order numbers).\n\n"
+                       + transcript
+        }],
+        temperature=0.2,
+        max_tokens=300
+    )
+    return response.choices[0].message.content
+
+
 def main():
     parser = argparse.ArgumentParser(description='Chat with Fine-Tuned Model')
     parser.add_argument('--system', default='default', help='System prompt key to use')
@@ -62,6 +75,18 @@ def main():
         
     # Get system prompt
     system_prompt = config['system_prompts'].get(args.system, config['system_prompts']['default'])
+    system_key = args.system
+    
+    # Older turns get summarized in the background once history passes this many turns
+    max_turns = config.get('chatbot', {}).get('max_history_turns', 10)
+    summary_model = config['openai']['model_validation']
+    summarizer = ThreadPoolExecutor(max_workers=1)
+    pending_summary = None  # (future, number of messages after the system prompt it covers)
+    
+    # Requests sharing a cache key are routed together so the unchanged
+    # prefix (system prompt + earlier turns) is served from the prompt cache
+    conversation = 0
+    cache_key = f"chatbot:{system_key}:{conversation}"
     
     print(f"\n{'='*50}")
     print(f"Chatting with: {model_id}")
@@ -86,6 +111,9 @@ def main():
                 
             if user_input.lower() == '/clear':
                 messages = [{"role": "system", "content": system_prompt}]
+                pending_summary = None
+                conversation += 1
+                cache_key = f"chatbot:{system_key}:{conversation}"
                 print("Conversation history cleared.")
                 continue
                 
@@ -94,12 +122,27 @@ def main():
                 new_prompt = config['system_prompts'].get(key)
                 if new_prompt:
                     system_prompt = new_prompt
+                    system_key = key
                     messages = [{"role": "system", "content": system_prompt}]
+                    pending_summary = None
+                    conversation += 1
+                    cache_key = f"chatbot:{system_key}:{conversation}"
                     print(f"Switched to system prompt: {key}")
                 else:
                     print(f"System prompt '{key}' not found.")
                 continue
             
+            # Fold in a finished summary; this changes the prefix once per
+            # compaction instead of every turn
+            if pending_summary and pending_summary[0].done():
+                future, covered = pending_summary
+                pending_summary = None
+                try:
+                    note = {"role": "system", "content": f"Summary of the earlier conversation: {future.result()}"}
+                    messages = [messages[0], note] + messages[covered + 1:]
+                except Exception as e:
+                    logger.warning(f"History summarization failed: {e}")
+            
             # Add user message
             messages.append({"role": "user", "content": user_input})
             
@@ -109,7 +152,8 @@ def main():
             stream = client.chat.completions.create(
                 model=model_id,
                 messages=messages,
-                stream=True
+                stream=True,
+                extra_body={"prompt_cache_key": cache_key}
             )
             
             collected_response = ""
@@ -124,11 +168,21 @@ def main():
             # Add assistant message to history
             messages.append({"role": "assistant", "content": collected_response})
             
+            # Summarize all but the most recent half of the turns once history gets long
+            if pending_summary is None and len(messages) > 2 * max_turns + 1:
+                covered = len(messages) - 1 - 2 * (max_turns // 2)
+                pending_summary = (
+                    summarizer.submit(summarize_history, client, summary_model, messages[1:covered + 1]),
+                    covered
+                )
+            
         except KeyboardInterrupt:
             print("\nExiting...")
             break
         except Exception as e:
             print(f"\nError: {e}")
+    
+    summarizer.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,23 @@
+"""
+Configuration loading shared by the pipeline scripts and web app.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+
+import yaml
+
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+CONFIG_PATH = Path(__file__).parent.parent / 'config' / 'config.yaml'
+
+
+@lru_cache(maxsize=1)
+def load_config(config_path: Path = CONFIG_PATH) -> dict:
+    """Load configuration from config.yaml, parsing it once per process."""
+    with open(config_path) as f:
+        return yaml.load(f, Loader=SafeLoader)
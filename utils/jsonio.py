@@ -0,0 +1,157 @@
+"""
+JSON file helpers backed by orjson.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import ijson
+import orjson
+
+
+def load_json(path: Path):
+    """Load a JSON file."""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+def dump_json(path: Path, data) -> None:
+    """Write data to a JSON file with 2-space indentation."""
+    with open(path, 'wb') as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+
+def dump_json_array(path: Path, items: Iterable) -> int:
+    """Write an iterable to a JSON array file one item at a time.
+    
+    The layout matches dump_json, but only one item is held in memory.
+    Returns the number of items written.
+    """
+    count = 0
+    with open(path, 'wb') as f:
+        for item in items:
+            f.write(b',\n  ' if count else b'[\n  ')
+            f.write(orjson.dumps(item, option=orjson.OPT_INDENT_2).replace(b'\n', b'\n  '))
+            count += 1
+        f.write(b'\n]' if count else b'[]')
+    return count
+
+
+def open_writer(path: Path):
+    """Open a file for binary writing, zstd-compressing it if the name ends in .zst."""
+    if path.suffix == '.zst':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+
+def iter_json_array(path: Path) -> Iterator:
+    """Yield the items of a top-level JSON array one at a time.
+    
+    ijson picks its C (yajl2_c) backend when available, so large files are
+    parsed without materializing the whole list.
+    """
+    with open(path, 'rb') as f:
+        yield from ijson.items(f, 'item', use_float=True)
+
+
+def iter_jsonl(path: Path) -> Iterator:
+    """Yield records from a JSONL log, skipping blank lines.
+    
+    A last line without a trailing newline is a record whose write was
+    interrupted; it is dropped rather than parsed.
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            if line.strip():
+                yield orjson.loads(line)
+
+
+def _trim_partial_line(fd: int):
+    """Truncate a log back to the end of its last complete line."""
+    end = os.lseek(fd, 0, os.SEEK_END)
+    pos = end
+    new_size = 0
+    while pos > 0:
+        start = max(0, pos - 65536)
+        newline = os.pread(fd, pos - start, start).rfind(b'\n')
+        if newline != -1:
+            new_size = start + newline + 1
+            break
+        pos = start
+    if new_size != end:
+        os.ftruncate(fd, new_size)
+
+
+class JsonlAppender:
+    """Append-only JSONL log used for incremental checkpoints.
+    
+    Records are collected in a user-space buffer and written with os.write
+    once it reaches buffer_size. A background thread writes out the buffer and
+    fsyncs the log every flush_interval seconds, and close() does a final
+    flush. A crash loses at most the last flush_interval seconds of records;
+    any partial last line is skipped by iter_jsonl and trimmed when the log is
+    reopened for appending.
+    """
+    
+    def __init__(self, path: Path, truncate: bool = False,
+                 buffer_size: int = 64 * 1024, flush_interval: float = 5.0):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        flags = os.O_RDWR | os.O_CREAT | (os.O_TRUNC if truncate else os.O_APPEND)
+        self._fd = os.open(path, flags, 0o644)
+        if not truncate:
+            _trim_partial_line(self._fd)
+        
+        self._buffer = bytearray()
+        self._buffer_size = buffer_size
+        self._unsynced = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_loop, args=(flush_interval,), daemon=True)
+        self._syncer.start()
+    
+    def append(self, record) -> None:
+        """Buffer a single record, writing the buffer out once it is full."""
+        line = orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        with self._lock:
+            self._buffer += line
+            if len(self._buffer) >= self._buffer_size:
+                self._write_buffer()
+    
+    def _write_buffer(self):
+        """Write buffered bytes to the file. Caller must hold the lock."""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        while data:
+            data = data[os.write(self._fd, data):]
+        self._unsynced = True
+    
+    def flush(self):
+        """Write out buffered records and sync the log to disk."""
+        with self._lock:
+            if self._buffer:
+                self._write_buffer()
+            unsynced, self._unsynced = self._unsynced, False
+        if unsynced:
+            os.fsync(self._fd)
+    
+    def _sync_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            self.flush()
+    
+    def close(self):
+        self._closed.set()
+        self._syncer.join()
+        self.flush()
+        os.close(self._fd)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
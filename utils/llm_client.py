@@ -3,11 +3,17 @@ OpenAI LLM client with batch API support for question and answer generation.
 """
 
 import os
-import json
 import time
+import keyword
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, count, islice
 from pathlib import Path
-from typing import Optional
+from string import Formatter
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+import orjson
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -24,9 +30,12 @@ class LLMClient:
         self.config = config
         self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
         self.model = config['openai']['model']
+        self.embedding_model = config['openai'].get('embedding_model', 'text-embedding-3-small')
         self.max_retries = config['openai']['max_retries']
         self.retry_delay = config['openai']['retry_delay_seconds']
         self.batch_check_interval = config['openai']['batch_check_interval_seconds']
+        self.batch_check_max_interval = config['openai'].get('batch_check_max_interval_seconds', 300)
+        self.max_batch_requests = config['openai'].get('max_requests_per_batch', 50000)
     
     def generate_single(self, prompt: str, temperature: float = 0.7, max_tokens: int = 1000) -> Optional[str]:
         """Generate a single completion (for testing/fallback)."""
@@ -48,10 +57,58 @@ class LLMClient:
                     return None
         return None
     
-    def create_batch_file(self, requests: list[dict], output_path: Path) -> Path:
+    def embed(self, texts: list[str], inputs_per_request: int = 2048,
+              chars_per_request: int = 300_000) -> np.ndarray:
+        """Embed texts synchronously, sending several inputs per request.
+        
+        Requests are capped by input count and by total characters, which
+        keeps them under the endpoint's per-request token limit (a token is
+        at least about one character). Blank texts are rejected by the API,
+        so they are not sent and get zero rows.
+        
+        Returns a float32 array with one row per text in input order.
+        """
+        # Group the non-blank texts into requests within both budgets
+        chunks = []
+        chunk, chunk_chars = [], 0
+        for i, text in enumerate(texts):
+            if not text.strip():
+                continue
+            if chunk and (len(chunk) == inputs_per_request or chunk_chars + len(text) > chars_per_request):
+                chunks.append(chunk)
+                chunk, chunk_chars = [], 0
+            chunk.append(i)
+            chunk_chars += len(text)
+        if chunk:
+            chunks.append(chunk)
+        
+        rows = {}
+        for chunk in chunks:
+            for attempt in range(self.max_retries):
+                try:
+                    response = self.client.embeddings.create(
+                        model=self.embedding_model, input=[texts[i] for i in chunk]
+                    )
+                    break
+                except Exception as e:
+                    logger.warning(f"Attempt {attempt + 1} failed: {e}")
+                    if attempt == self.max_retries - 1:
+                        raise
+                    time.sleep(self.retry_delay * (2 ** attempt))
+            for item in response.data:
+                rows[chunk[item.index]] = item.embedding
+        
+        dim = len(next(iter(rows.values()))) if rows else 0
+        vectors = np.zeros((len(texts), dim), dtype=np.float32)
+        for i, embedding in rows.items():
+            vectors[i] = embedding
+        return vectors
+    
+    def create_batch_file(self, requests: Iterable[dict], output_path: Path) -> Path:
         """Create a JSONL file for batch processing.
         
-        Each request should have:
+        Requests may be any iterable (e.g. a generator); each one is encoded
+        and written as it is produced. Each request should have:
         - custom_id: Unique identifier for the request
         - prompt: The prompt to send
         - temperature: Optional temperature override
@@ -59,7 +116,8 @@ class LLMClient:
         """
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(output_path, 'w') as f:
+        count = 0
+        with open(output_path, 'wb') as f:
             for req in requests:
                 batch_request = {
                     "custom_id": req['custom_id'],
@@ -72,9 +130,11 @@ class LLMClient:
                         "max_tokens": req.get('max_tokens', 1000)
                     }
                 }
-                f.write(json.dumps(batch_request) + '\n')
+                f.write(orjson.dumps(batch_request))
+                f.write(b'\n')
+                count += 1
         
-        logger.info(f"Created batch file with {len(requests)} requests: {output_path}")
+        logger.info(f"Created batch file with {count} requests: {output_path}")
         return output_path
     
     def upload_batch_file(self, file_path: Path) -> str:
@@ -87,11 +147,12 @@ class LLMClient:
         logger.info(f"Uploaded batch file: {file_response.id}")
         return file_response.id
     
-    def submit_batch(self, file_id: str, description: str = "Atom helpdesk batch") -> str:
+    def submit_batch(self, file_id: str, description: str = "Atom helpdesk batch",
+                     endpoint: str = "/v1/chat/completions") -> str:
         """Submit a batch job and return batch ID."""
         batch = self.client.batches.create(
             input_file_id=file_id,
-            endpoint="/v1/chat/completions",
+            endpoint=endpoint,
             completion_window="24h",
             metadata={"description": description}
         )
@@ -99,9 +160,14 @@ class LLMClient:
         return batch.id
     
     def wait_for_batch(self, batch_id: str, max_wait_hours: int = 24) -> dict:
-        """Wait for batch to complete and return status."""
+        """Wait for batch to complete and return status.
+        
+        The poll interval doubles after each check, up to
+        batch_check_max_interval_seconds.
+        """
         max_wait_seconds = max_wait_hours * 3600
         start_time = time.time()
+        interval = self.batch_check_interval
         
         while True:
             batch = self.client.batches.retrieve(batch_id)
@@ -131,63 +197,205 @@ class LLMClient:
                 return {'status': 'timeout'}
             
             # Wait before checking again
-            time.sleep(self.batch_check_interval)
+            time.sleep(interval)
+            interval = min(interval * 2, self.batch_check_max_interval)
+    
+    def wait_for_batches(self, batch_ids: list[str], max_wait_hours: int = 24) -> list[dict]:
+        """Wait for several batches at once, returning their statuses in order."""
+        if len(batch_ids) <= 1:
+            return [self.wait_for_batch(batch_id, max_wait_hours) for batch_id in batch_ids]
+        
+        with ThreadPoolExecutor(max_workers=len(batch_ids)) as executor:
+            return list(executor.map(lambda batch_id: self.wait_for_batch(batch_id, max_wait_hours), batch_ids))
+    
+    def iter_batch_output(self, output_file_id: str) -> Iterator[dict]:
+        """Stream a batch output file, yielding each parsed result line.
+        
+        The file is read in 64 KB chunks, so only the current line is held in
+        memory rather than the whole download.
+        """
+        buf = bytearray()
+        with self.client.files.with_streaming_response.content(output_file_id) as response:
+            for chunk in response.iter_bytes(chunk_size=1 << 16):
+                buf += chunk
+                start = 0
+                while (end := buf.find(b'\n', start)) != -1:
+                    if end > start:
+                        yield orjson.loads(buf[start:end])
+                    start = end + 1
+                del buf[:start]
+        if buf.strip():
+            yield orjson.loads(buf)
     
     def get_batch_results(self, output_file_id: str) -> list[dict]:
         """Download and parse batch results."""
-        content = self.client.files.content(output_file_id)
         results = []
         
-        for line in content.text.strip().split('\n'):
-            if line:
-                result = json.loads(line)
-                custom_id = result['custom_id']
-                
-                if result.get('error'):
-                    results.append({
-                        'custom_id': custom_id,
-                        'error': result['error'],
-                        'content': None
-                    })
-                else:
-                    content = result['response']['body']['choices'][0]['message']['content']
-                    results.append({
-                        'custom_id': custom_id,
-                        'error': None,
-                        'content': content
-                    })
+        for result in self.iter_batch_output(output_file_id):
+            custom_id = result['custom_id']
+            
+            if result.get('error'):
+                results.append({
+                    'custom_id': custom_id,
+                    'error': result['error'],
+                    'content': None
+                })
+            else:
+                content = result['response']['body']['choices'][0]['message']['content']
+                results.append({
+                    'custom_id': custom_id,
+                    'error': None,
+                    'content': content
+                })
         
         logger.info(f"Retrieved {len(results)} batch results")
         return results
     
-    def run_batch(self, requests: list[dict], batch_file_path: Path, description: str = "Batch job") -> list[dict]:
-        """Full batch workflow: create file, upload, submit, wait, get results."""
-        # Create batch file
-        self.create_batch_file(requests, batch_file_path)
+    def run_batch(self, requests: Iterable[dict], batch_file_path: Path, description: str = "Batch job") -> list[dict]:
+        """Full batch workflow: create file, upload, submit, wait, get results.
         
-        # Upload file
-        file_id = self.upload_batch_file(batch_file_path)
+        Requests beyond max_requests_per_batch are split into further batch
+        files (batch_file_path with a _1, _2, ... suffix). Each part is
+        submitted as soon as it is written, and all parts are polled
+        concurrently.
+        """
+        requests = iter(requests)
+        batch_ids = []
         
-        # Submit batch
-        batch_id = self.submit_batch(file_id, description)
+        for part in count():
+            first = next(requests, None)
+            if first is None:
+                break
+            
+            # Create batch file
+            part_path = batch_file_path if part == 0 else batch_file_path.with_name(
+                f"{batch_file_path.stem}_{part}{batch_file_path.suffix}"
+            )
+            self.create_batch_file(chain([first], islice(requests, self.max_batch_requests - 1)), part_path)
+            
+            # Upload file and submit batch
+            file_id = self.upload_batch_file(part_path)
+            batch_ids.append(self.submit_batch(file_id, description))
         
         # Wait for completion
+        results = []
+        for batch_id, result in zip(batch_ids, self.wait_for_batches(batch_ids)):
+            if result['status'] != 'completed':
+                logger.error(f"Batch {batch_id} failed with status: {result['status']}")
+                continue
+            
+            # Get results
+            results.extend(self.get_batch_results(result['output_file_id']))
+        
+        return results
+    
+    def embed_batch(self, texts: list[str], batch_file_path: Path, description: str = "Embedding batch",
+                    inputs_per_request: int = 256) -> Optional[np.ndarray]:
+        """Embed texts through the batch API.
+        
+        Texts are grouped several to a request to keep the request count down.
+        Returns a float32 array with one row per text in input order, or None if
+        the batch did not complete or any text is missing an embedding, so
+        callers fall back rather than work with zero rows.
+        """
+        batch_file_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        with open(batch_file_path, 'wb') as f:
+            for start in range(0, len(texts), inputs_per_request):
+                f.write(orjson.dumps({
+                    "custom_id": f"emb_{start}",
+                    "method": "POST",
+                    "url": "/v1/embeddings",
+                    "body": {
+                        "model": self.embedding_model,
+                        "input": texts[start:start + inputs_per_request]
+                    }
+                }, option=orjson.OPT_APPEND_NEWLINE))
+        logger.info(f"Created embedding batch file for {len(texts)} texts: {batch_file_path}")
+        
+        file_id = self.upload_batch_file(batch_file_path)
+        batch_id = self.submit_batch(file_id, description, endpoint="/v1/embeddings")
         result = self.wait_for_batch(batch_id)
         
         if result['status'] != 'completed':
-            logger.error(f"Batch failed with status: {result['status']}")
-            return []
+            logger.error(f"Embedding batch failed with status: {result['status']}")
+            return None
+        
+        if not result.get('output_file_id'):
+            logger.error("Embedding batch produced no output")
+            return None
+        
+        vectors = None
+        filled = np.zeros(len(texts), dtype=bool)
         
-        # Get results
-        return self.get_batch_results(result['output_file_id'])
+        for item in self.iter_batch_output(result['output_file_id']):
+            response = item.get('response') or {}
+            if item.get('error') or response.get('status_code') != 200:
+                logger.warning(f"Embedding request {item['custom_id']} failed: "
+                               f"{item.get('error') or response.get('body')}")
+                continue
+            start = int(item['custom_id'][len('emb_'):])
+            for row in response['body']['data']:
+                if vectors is None:
+                    vectors = np.zeros((len(texts), len(row['embedding'])), dtype=np.float32)
+                vectors[start + row['index']] = row['embedding']
+                filled[start + row['index']] = True
+        
+        missing = len(texts) - int(filled.sum())
+        if missing:
+            logger.error(f"Embedding batch is missing {missing} of {len(texts)} embeddings")
+            return None
+        
+        return vectors
+
+
+
+
+def compile_prompt(template: str) -> Callable[..., str]:
+    """Compile a str.format-style template into a render function.
+    
+    The template is parsed once and turned into a generated function that
+    joins the literal chunks with the keyword values, so rendering does not
+    re-parse the template. The function's required keyword-only parameters
+    are the template fields (also exposed as `render.fields`); extra keyword
+    arguments are ignored, as with str.format.
+    """
+    chunks = []
+    fields = []
+    for literal, field_name, format_spec, conversion in Formatter().parse(template):
+        if literal:
+            chunks.append(repr(literal))
+        if field_name is None:
+            continue
+        if (not field_name.isidentifier() or keyword.iskeyword(field_name)
+                or field_name.startswith('_') or format_spec or conversion):
+            # Indexed, attribute, formatted or underscore fields are left to str.format
+            def render(**kwargs) -> str:
+                return template.format(**kwargs)
+            render.fields = None
+            return render
+        if field_name not in fields:
+            fields.append(field_name)
+        chunks.append(f"_str({field_name})")
+    
+    params = ''.join(f"{name}, " for name in fields)
+    source = (
+        f"def render(*, {params}_str=str, **_):\n"
+        f"    return ''.join([{', '.join(chunks)}])\n"
+    )
+    namespace = {}
+    exec(compile(source, '<prompt template>', 'exec'), namespace)
+    render = namespace['render']
+    render.fields = tuple(fields)
+    return render
 
 
-def load_prompt(prompt_path: Path) -> str:
-    """Load a prompt template from file."""
+def load_prompt(prompt_path: Path) -> Callable[..., str]:
+    """Load a prompt template from file and compile it."""
     with open(prompt_path, 'r') as f:
-        return f.read()
+        return compile_prompt(f.read())
 
 
-def format_prompt(template: str, **kwargs) -> str:
-    """Format a prompt template with variables."""
-    return template.format(**kwargs)
+def format_prompt(template: Callable[..., str], **kwargs) -> str:
+    """Render a compiled prompt template with variables."""
+    return template(**kwargs)
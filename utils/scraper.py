@@ -2,34 +2,146 @@
 Scraper utilities for extracting content from Atom helpdesk.
 """
 
+import os
 import re
+import gzip
 import time
+import asyncio
+import hashlib
 import logging
+import aiohttp
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 import html2text
+import lxml.html
+from lxml import etree
+from pathlib import Path
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+_COLLECTION_RE = re.compile(r'/collections/(\d+)-(.+?)(?:\?|$|#)')
+_ARTICLE_RE = re.compile(r'/articles/(\d+)-(.+?)(?:\?|$|#)')
+_TITLE_SUFFIX_RE = re.compile(r'\s*\|\s*Atom Help Center.*$')
+# Markdown cleanup: excess newlines, leftover HTML tags, javascript: links
+# (kept as their text, minus any tags) and "Skip to main content" lines, in a
+# single scan. Unlike separate passes, text that only joins up once a tag is
+# removed (a newline run, or newlines after "Skip to main content") is kept.
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_MARKDOWN_CLEANUP_RE = re.compile(
+    r'(?P<newlines>\n{3,})'
+    r'|<[^>]+>'
+    r'|\[(?P<link_text>[^\]]+)\]\(javascript:[^)]*\)'
+    r'|Skip to main content\n*'
+)
+
+# Text nodes under an element, skipping script/style contents and comments
+_TEXT_NODES = etree.XPath('descendant::text()[not(parent::script or parent::style)]')
+
+# Headers and the content elements between them, in document order
+_SECTION_NODES = etree.XPath('.//h1 | .//h2 | .//h3 | .//h4 | .//p | .//li | .//td | .//span')
+_HEADER_TAGS = frozenset(['h1', 'h2', 'h3', 'h4'])
+# Related-article links and media elements, in document order
+_PAGE_NODES = etree.XPath(
+    '//a[contains(@href, "/articles/")] | //img | //table | //video'
+    ' | //iframe[contains(@src, "youtube") or contains(@src, "vimeo")]'
+)
+
+
+def _markdown_cleanup_repl(match: re.Match) -> str:
+    """Replacement for a _MARKDOWN_CLEANUP_RE match."""
+    if match.group('newlines'):
+        return '\n\n'
+    link_text = match.group('link_text')
+    if link_text:
+        # The link is matched before any tags inside its text
+        return _HTML_TAG_RE.sub('', link_text)
+    return ''
+
+
+def _get_text(element, separator: str = '') -> str:
+    """Join the element's stripped, non-empty text nodes (like BeautifulSoup's get_text(strip=True))."""
+    return separator.join(s for s in (text.strip() for text in _TEXT_NODES(element)) if s)
+
+
+def _has_class(name: str) -> str:
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+def _single_string(element) -> bool:
+    """Whether the element holds exactly one string, directly or via a single child chain."""
+    children = list(element)
+    count = (1 if element.text else 0) + sum(1 + (1 if child.tail else 0) for child in children)
+    if count != 1:
+        return False
+    if element.text:
+        return True
+    child = children[0]
+    return not isinstance(child.tag, str) or _single_string(child)
+
+
+class TokenBucket:
+    """Async token-bucket rate limiter.
+    
+    Allows bursts of up to `capacity` requests while holding the long-run
+    rate to `rate` requests per second.
+    """
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
 
 class Scraper:
     """Scraper for Atom helpdesk articles."""
     
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, cache_dir: Optional[Path] = None, cache_ttl_hours: Optional[float] = None):
         self.config = config
         self.base_url = config['scraping']['base_url']
         self.delay = config['scraping']['request_delay_seconds']
         self.max_retries = config['scraping']['max_retries']
         self.timeout = config['scraping']['timeout_seconds']
         self.user_agent = config['scraping']['user_agent']
+        self.concurrency = config['scraping'].get('concurrency', 10)
+        self.keep_raw_html = config['scraping'].get('keep_raw_html', False)
+        self.rate_limiter = TokenBucket(
+            config['scraping'].get('requests_per_second', 10),
+            config['scraping'].get('burst_size', self.concurrency)
+        )
         
-        self.session = requests.Session()
-        self.session.headers.update({
+        # Raw HTML cache; disabled when cache_dir is None
+        self.cache_dir = cache_dir
+        if cache_ttl_hours is None:
+            cache_ttl_hours = config['scraping'].get('cache_ttl_hours', 24)
+        self.cache_ttl = cache_ttl_hours * 3600
+        
+        self.headers = {
             'User-Agent': self.user_agent,
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.5',
-        })
+        }
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # Everything is on one host: keep a single pool sized for our concurrency.
+        # Retries are handled by fetch_page's own loop.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         
         self.html_converter = html2text.HTML2Text()
         self.html_converter.ignore_links = False
@@ -45,13 +157,56 @@ class Scraper:
             time.sleep(self.delay - elapsed)
         self._last_request_time = time.time()
     
+    def _cache_path(self, url: str) -> Path:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.cache_dir / key[:2] / key
+    
+    def get_cached_page(self, url: str) -> Optional[str]:
+        """Return cached HTML for a URL if present and younger than the TTL."""
+        if self.cache_dir is None:
+            return None
+        path = self._cache_path(url)
+        try:
+            if time.time() - path.stat().st_mtime > self.cache_ttl:
+                return None
+            return gzip.decompress(path.read_bytes()).decode()
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, UnicodeDecodeError) as e:
+            logger.warning(f"Ignoring unreadable cache entry for {url}: {e}")
+            return None
+    
+    def _cache_page(self, url: str, html: str):
+        """Store fetched HTML in the cache."""
+        if self.cache_dir is None:
+            return
+        path = self._cache_path(url)
+        # Write to a temp file first so readers never see a partial entry
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(gzip.compress(html.encode()))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # The page itself was fetched fine; only the cache entry is lost
+            logger.warning(f"Could not cache {url}: {e}")
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+    
     def fetch_page(self, url: str) -> Optional[str]:
-        """Fetch a page with retry logic."""
+        """Fetch a page with retry logic, serving from the cache when possible."""
+        cached = self.get_cached_page(url)
+        if cached is not None:
+            return cached
+        
         for attempt in range(self.max_retries):
             try:
                 self._rate_limit()
                 response = self.session.get(url, timeout=self.timeout)
                 response.raise_for_status()
+                self._cache_page(url, response.text)
                 return response.text
             except requests.RequestException as e:
                 logger.warning(f"Attempt {attempt + 1} failed for {url}: {e}")
@@ -62,6 +217,43 @@ class Scraper:
                     return None
         return None
     
+    def create_async_session(self) -> aiohttp.ClientSession:
+        """Create an aiohttp session for concurrent fetching."""
+        connector = aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=self.concurrency,
+            enable_cleanup_closed=True
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+    
+    async def fetch_page_async(self, session: aiohttp.ClientSession, url: str) -> Optional[str]:
+        """Fetch a page on a shared aiohttp session with retry logic."""
+        cached = self.get_cached_page(url)
+        if cached is not None:
+            return cached
+        
+        for attempt in range(self.max_retries):
+            try:
+                await self.rate_limiter.acquire()
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    # Like requests, don't fail the page over a wrong or missing charset
+                    html = await response.text(errors='replace')
+                self._cache_page(url, html)
+                return html
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Attempt {attempt + 1} failed for {url}: {e}")
+                if attempt < self.max_retries - 1:
+                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                else:
+                    logger.error(f"Failed to fetch {url} after {self.max_retries} attempts")
+                    return None
+        return None
+    
     # Known collection name mappings for clean names
     COLLECTION_NAMES = {
         'atom-com-registrar': 'Atom.com Registrar',
@@ -77,18 +269,19 @@ class Scraper:
     
     def extract_collections(self, homepage_html: str) -> list[dict]:
         """Extract collection URLs from the homepage."""
-        soup = BeautifulSoup(homepage_html, 'lxml')
+        tree = lxml.html.fromstring(homepage_html)
         collections = []
+        seen_ids = set()
         
         # Find all collection links
-        for link in soup.select('a[href*="/collections/"]'):
+        for link in tree.xpath('//a[contains(@href, "/collections/")]'):
             href = link.get('href', '')
             if '/collections/' in href and href.startswith(('http', '/')):
                 # Extract collection info
                 url = href if href.startswith('http') else f"https://helpdesk.atom.com{href}"
                 
                 # Extract collection ID from URL
-                match = re.search(r'/collections/(\d+)-(.+?)(?:\?|$|#)', url)
+                match = _COLLECTION_RE.search(url)
                 if match:
                     collection_id = match.group(1)
                     slug = match.group(2)
@@ -97,7 +290,8 @@ class Scraper:
                     name = self.COLLECTION_NAMES.get(slug, slug.replace('-', ' ').title())
                     
                     # Avoid duplicates
-                    if not any(c['id'] == collection_id for c in collections):
+                    if collection_id not in seen_ids:
+                        seen_ids.add(collection_id)
                         collections.append({
                             'id': collection_id,
                             'slug': slug,
@@ -110,26 +304,28 @@ class Scraper:
     
     def extract_articles_from_collection(self, collection_html: str, collection_info: dict) -> list[dict]:
         """Extract all article URLs from a collection page."""
-        soup = BeautifulSoup(collection_html, 'lxml')
+        tree = lxml.html.fromstring(collection_html)
         articles = []
+        seen_ids = set()
         
         # Find all article links
-        for link in soup.select('a[href*="/articles/"]'):
+        for link in tree.xpath('//a[contains(@href, "/articles/")]'):
             href = link.get('href', '')
             if '/articles/' in href:
                 url = href if href.startswith('http') else f"https://helpdesk.atom.com{href}"
                 
                 # Extract article ID
-                match = re.search(r'/articles/(\d+)-(.+?)(?:\?|$|#)', url)
+                match = _ARTICLE_RE.search(url)
                 if match:
                     article_id = match.group(1)
                     slug = match.group(2)
                     
                     # Get title from link text
-                    title = link.get_text(strip=True)
+                    title = _get_text(link)
                     
                     # Avoid duplicates
-                    if not any(a['id'] == article_id for a in articles):
+                    if article_id not in seen_ids:
+                        seen_ids.add(article_id)
                         articles.append({
                             'id': article_id,
                             'slug': slug,
@@ -144,62 +340,79 @@ class Scraper:
     
     def extract_article_content(self, article_html: str, article_info: dict) -> dict:
         """Extract structured content from an article page."""
-        soup = BeautifulSoup(article_html, 'lxml')
+        tree = lxml.html.fromstring(article_html)
         
         # Find the main article content
-        article_body = soup.select_one('article') or soup.select_one('.article-body') or soup.select_one('main')
+        article_body = None
+        for xpath in ['//article', f'//*[{_has_class("article-body")}]', '//main']:
+            matches = tree.xpath(xpath)
+            if matches:
+                article_body = matches[0]
+                break
         
-        if not article_body:
+        if article_body is None:
             logger.warning(f"Could not find article body for {article_info['url']}")
-            article_body = soup.body or soup
+            article_body = tree.find('body')
+            if article_body is None:
+                article_body = tree
         
-        # Remove navigation, footer, and other non-content elements
-        for selector in ['nav', 'footer', 'header', '.intercom-reaction', '.intercom-article-meta', 
-                         '[data-testid="article-footer"]', '.article-footer', 'script', 'style']:
-            for element in article_body.select(selector):
-                element.decompose()
+        # Remove navigation, footer, and other non-content elements (keeping their tail text)
+        for xpath in ['.//nav', './/footer', './/header', f'.//*[{_has_class("intercom-reaction")}]',
+                      f'.//*[{_has_class("intercom-article-meta")}]', './/*[@data-testid="article-footer"]',
+                      f'.//*[{_has_class("article-footer")}]', './/script', './/style']:
+            for element in article_body.xpath(xpath):
+                element.drop_tree()
         
         # Get the title
-        title_elem = soup.select_one('h1') or soup.select_one('title')
-        title = title_elem.get_text(strip=True) if title_elem else article_info.get('title', '')
+        title_elem = tree.find('.//h1')
+        if title_elem is None:
+            title_elem = tree.find('.//title')
+        title = _get_text(title_elem) if title_elem is not None else article_info.get('title', '')
         # Clean title
-        title = re.sub(r'\s*\|\s*Atom Help Center.*$', '', title)
+        title = _TITLE_SUFFIX_RE.sub('', title)
         
         # Get description from meta tag
-        meta_desc = soup.select_one('meta[name="description"]') or soup.select_one('meta[property="og:description"]')
-        description = meta_desc.get('content', '') if meta_desc else ''
+        meta_desc = tree.xpath('//meta[@name="description"]') or tree.xpath('//meta[@property="og:description"]')
+        description = meta_desc[0].get('content', '') if meta_desc else ''
         
         # Convert to markdown
-        raw_html = str(article_body)
+        raw_html = lxml.html.tostring(article_body, encoding='unicode', with_tail=False)
         markdown = self.html_converter.handle(raw_html)
         
         # Clean up markdown
         markdown = self._clean_markdown(markdown)
         
-        # Extract plain text
-        plain_text = article_body.get_text(separator=' ', strip=True)
-        plain_text = re.sub(r'\s+', ' ', plain_text).strip()
+        # Extract plain text; split/join collapses whitespace in one pass
+        plain_text = ' '.join(' '.join(_TEXT_NODES(article_body)).split())
         
         # Extract sections (headers and their content)
         sections = self._extract_sections(article_body)
         
-        # Find related articles
+        # Find related articles and media flags in a single document-order pass
         related = []
-        for link in soup.select('a[href*="/articles/"]'):
-            href = link.get('href', '')
-            link_text = link.get_text(strip=True)
-            if href and link_text and href != article_info['url']:
-                url = href if href.startswith('http') else f"https://helpdesk.atom.com{href}"
-                if not any(r['url'] == url for r in related):
-                    related.append({'title': link_text, 'url': url.split('?')[0]})
+        seen_urls = set()
+        has_images = has_tables = has_video = False
+        for element in _PAGE_NODES(tree):
+            tag = element.tag
+            if tag == 'a':
+                href = element.get('href', '')
+                link_text = _get_text(element)
+                if href and link_text and href != article_info['url']:
+                    url = href if href.startswith('http') else f"https://helpdesk.atom.com{href}"
+                    if url not in seen_urls:
+                        seen_urls.add(url.split('?')[0])
+                        related.append({'title': link_text, 'url': url.split('?')[0]})
+            elif tag == 'img':
+                has_images = True
+            elif tag == 'table':
+                has_tables = True
+            else:
+                has_video = True
         
         # Get metadata
         word_count = len(plain_text.split())
-        has_images = bool(soup.select('img'))
-        has_tables = bool(soup.select('table'))
-        has_video = bool(soup.select('video, iframe[src*="youtube"], iframe[src*="vimeo"]'))
         
-        return {
+        article = {
             'article_id': article_info['id'],
             'url': article_info['url'],
             'title': title,
@@ -207,7 +420,6 @@ class Scraper:
             'collection': article_info['collection'],
             'collection_id': article_info['collection_id'],
             'content': {
-                'raw_html': raw_html,
                 'markdown': markdown,
                 'plain_text': plain_text,
                 'sections': sections
@@ -220,20 +432,16 @@ class Scraper:
                 'has_video': has_video
             }
         }
+        
+        # The article HTML is usually several times the size of everything else
+        if self.keep_raw_html:
+            article['content']['raw_html'] = raw_html
+        
+        return article
     
     def _clean_markdown(self, markdown: str) -> str:
         """Clean up converted markdown."""
-        # Remove excessive newlines
-        markdown = re.sub(r'\n{3,}', '\n\n', markdown)
-        
-        # Remove leftover HTML tags
-        markdown = re.sub(r'<[^>]+>', '', markdown)
-        
-        # Clean up link formatting
-        markdown = re.sub(r'\[([^\]]+)\]\(javascript:[^)]*\)', r'\1', markdown)
-        
-        # Remove "Skip to main content" and similar
-        markdown = re.sub(r'Skip to main content\n*', '', markdown)
+        markdown = _MARKDOWN_CLEANUP_RE.sub(_markdown_cleanup_repl, markdown)
         
         # Trim whitespace
         markdown = markdown.strip()
@@ -246,8 +454,8 @@ class Scraper:
         current_section = None
         current_content = []
         
-        for element in article_body.descendants:
-            if element.name in ['h1', 'h2', 'h3', 'h4']:
+        for element in _SECTION_NODES(article_body):
+            if element.tag in _HEADER_TAGS:
                 # Save previous section
                 if current_section:
                     sections.append({
@@ -256,12 +464,12 @@ class Scraper:
                         'content': ' '.join(current_content).strip()
                     })
                 
-                current_section = element.get_text(strip=True)
-                current_section_level = int(element.name[1])
+                current_section = _get_text(element)
+                current_section_level = int(element.tag[1])
                 current_content = []
-            elif hasattr(element, 'name') and element.name in ['p', 'li', 'td', 'span'] and element.string:
-                text = element.get_text(strip=True)
-                if text and current_section:
+            elif current_section and _single_string(element):
+                text = _get_text(element)
+                if text:
                     current_content.append(text)
         
         # Save last section
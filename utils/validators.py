@@ -5,20 +5,52 @@ Validators for Q&A data quality checks.
 import re
 import json
 import logging
-from typing import Optional
+from collections import Counter
+from itertools import combinations
+from typing import Iterable, Optional, Union
 from difflib import SequenceMatcher
 
+import numpy as np
+import orjson
+
 logger = logging.getLogger(__name__)
 
+EXPECTED_ROLES = ('system', 'user', 'assistant')
+
+_NUMBER_RE = re.compile(r'\$?\d+(?:,\d{3})*(?:\.\d+)?%?')
+_JSON_CODE_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_CODE_BLOCK_RE = re.compile(r'```\s*(.*?)\s*```', re.DOTALL)
+
+# Phrases suggesting the answer is talking about its source rather than from it
+HALLUCINATION_MARKERS = (
+    "I don't have information",
+    "I cannot find",
+    "not mentioned in",
+    "According to the article",
+    "based on the document",
+    "the article states",
+    "as mentioned in the article"
+)
+_LOWERED_MARKERS = tuple((marker, marker.lower()) for marker in HALLUCINATION_MARKERS)
 
-def validate_json_structure(line: str) -> tuple[bool, Optional[str]]:
-    """Validate a JSONL line has correct structure."""
+# Prefixes of question-like queries; matched as prefixes, so "don't" and "issue" count too
+_QUESTION_STARTERS = ('how', 'what', 'when', 'where', 'why', 'who', 'can', 'do', 'does', 'is', 'are', 'will', 'should')
+
+
+def validate_json_structure(line: Union[bytes, str]) -> tuple[bool, Optional[str]]:
+    """Validate a JSONL line has correct structure.
+    
+    Accepts the raw bytes of a line, so callers reading in binary mode can
+    skip decoding it first.
+    """
     try:
-        data = json.loads(line)
-    except json.JSONDecodeError as e:
+        data = orjson.loads(line)
+    except orjson.JSONDecodeError as e:
         return False, f"Invalid JSON: {e}"
     
     # Check required fields
+    if not isinstance(data, dict):
+        return False, "Record is not an object"
     if 'messages' not in data:
         return False, "Missing 'messages' field"
     
@@ -27,10 +59,13 @@ def validate_json_structure(line: str) -> tuple[bool, Optional[str]]:
         return False, "Messages should be a list of 3 items (system, user, assistant)"
     
     # Check role sequence
-    expected_roles = ['system', 'user', 'assistant']
-    for i, (msg, expected_role) in enumerate(zip(messages, expected_roles)):
-        if msg.get('role') != expected_role:
-            return False, f"Message {i} should have role '{expected_role}', got '{msg.get('role')}'"
+    for i in range(3):
+        msg = messages[i]
+        if not isinstance(msg, dict):
+            return False, f"Message {i} is not an object"
+        role = msg.get('role')
+        if role != EXPECTED_ROLES[i]:
+            return False, f"Message {i} should have role '{EXPECTED_ROLES[i]}', got '{role}'"
         if not msg.get('content'):
             return False, f"Message {i} has empty content"
     
@@ -56,13 +91,35 @@ def validate_content_length(question: str, answer: str, config: dict) -> tuple[b
     return True, None
 
 
-def check_exact_duplicates(qa_pairs: list[dict]) -> list[int]:
-    """Find indices of exact duplicate Q&A pairs."""
+def content_length_mask(question_lengths: np.ndarray, answer_lengths: np.ndarray, config: dict) -> np.ndarray:
+    """Vectorized validate_content_length over arrays of lengths.
+    
+    Returns a boolean mask that is True where both lengths are within bounds.
+    """
+    v = config['validation']
+    return (
+        (question_lengths >= v['min_question_chars']) & (question_lengths <= v['max_question_chars']) &
+        (answer_lengths >= v['min_answer_chars']) & (answer_lengths <= v['max_answer_chars'])
+    )
+
+
+def normalize_question(question: str) -> str:
+    """Normalized form of a question used for duplicate checks."""
+    return question.strip().lower()
+
+
+def check_exact_duplicates(qa_pairs: list[dict], questions: Optional[list[str]] = None) -> list[int]:
+    """Find indices of exact duplicate Q&A pairs.
+    
+    questions may hold the already-normalized question of each pair.
+    """
+    if questions is None:
+        questions = [normalize_question(pair['question']) for pair in qa_pairs]
     seen = {}
     duplicates = []
     
     for i, pair in enumerate(qa_pairs):
-        key = (pair['question'].strip().lower(), pair['answer'].strip().lower())
+        key = (questions[i], pair['answer'].strip().lower())
         if key in seen:
             duplicates.append(i)
         else:
@@ -71,30 +128,131 @@ def check_exact_duplicates(qa_pairs: list[dict]) -> list[int]:
     return duplicates
 
 
-def check_near_duplicates(qa_pairs: list[dict], threshold: float = 0.95) -> list[tuple[int, int]]:
-    """Find pairs of near-duplicate questions."""
+def find_near_duplicate_candidates(embeddings, k: int = 5, threshold: float = 0.85) -> list[tuple[int, int]]:
+    """Find candidate near-duplicate pairs from question embeddings.
+    
+    Builds an HNSW index over the normalized vectors and keeps each row's
+    k nearest neighbours with cosine similarity >= threshold. Returns sorted
+    (i, j) pairs with i < j.
+    """
+    import faiss
+    
+    vectors = np.array(embeddings, dtype=np.float32)
+    if len(vectors) < 2:
+        return []
+    faiss.normalize_L2(vectors)
+    
+    index = faiss.IndexHNSWFlat(vectors.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+    index.add(vectors)
+    # Ask for one extra neighbour since each vector finds itself
+    scores, neighbors = index.search(vectors, min(k + 1, len(vectors)))
+    
+    candidates = set()
+    for i, (row_scores, row_neighbors) in enumerate(zip(scores, neighbors)):
+        for score, j in zip(row_scores, row_neighbors):
+            j = int(j)
+            if j >= 0 and j != i and score >= threshold:
+                candidates.add((min(i, j), max(i, j)))
+    
+    return sorted(candidates)
+
+
+def find_tfidf_candidates(questions: list[str], threshold: float = 0.8,
+                          block_size: int = 2048) -> list[tuple[int, int]]:
+    """Find candidate near-duplicate pairs by character n-gram cosine similarity.
+    
+    The L2-normalized term-frequency rows are multiplied against the whole matrix a
+    block at a time, so the similarity matrix is never held in full. Returns
+    sorted (i, j) pairs with i < j.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    
+    if len(questions) < 2:
+        return []
+    
+    # Empty questions have no n-grams but still match each other exactly;
+    # if every question is empty there is no vocabulary to fit at all
+    empty = [i for i, q in enumerate(questions) if not q]
+    if len(empty) == len(questions):
+        return list(combinations(empty, 2))
+    
+    # Plain term frequencies over character unigrams and bigrams: IDF weighting
+    # and longer n-grams let a single typo push true near-duplicates far apart
+    matrix = TfidfVectorizer(analyzer='char', ngram_range=(1, 2), use_idf=False).fit_transform(questions)
+    matrix_t = matrix.T.tocsr()
+    
+    candidates = []
+    for start in range(0, matrix.shape[0], block_size):
+        sims = (matrix[start:start + block_size] @ matrix_t).tocoo()
+        rows = sims.row + start
+        keep = (sims.data >= threshold) & (rows < sims.col)
+        candidates.extend(zip(rows[keep].tolist(), sims.col[keep].tolist()))
+    
+    candidates.extend(combinations(empty, 2))
+    
+    return sorted(candidates)
+
+
+def check_near_duplicates(qa_pairs: list[dict], threshold: float = 0.95,
+                          candidates: Optional[Iterable[tuple[int, int]]] = None,
+                          questions: Optional[list[str]] = None) -> list[tuple[int, int]]:
+    """Find pairs of near-duplicate questions.
+    
+    If candidates is given, only those (i, j) pairs are compared instead of
+    every pair. questions may hold the already-normalized question of each
+    pair.
+    """
     near_dupes = []
+    if questions is None:
+        questions = [normalize_question(pair['question']) for pair in qa_pairs]
+    char_counts = [None] * len(questions)
+    
+    if candidates is None:
+        candidates = ((i, j) for i in range(len(qa_pairs)) for j in range(i + 1, len(qa_pairs)))
     
-    for i in range(len(qa_pairs)):
-        for j in range(i + 1, len(qa_pairs)):
-            q1 = qa_pairs[i]['question'].strip().lower()
-            q2 = qa_pairs[j]['question'].strip().lower()
-            
-            similarity = SequenceMatcher(None, q1, q2).ratio()
-            if similarity >= threshold:
-                near_dupes.append((i, j))
+    for i, j in candidates:
+        q1 = questions[i]
+        q2 = questions[j]
+        total = len(q1) + len(q2)
+        
+        # Cheap upper bounds on ratio(): matches can't exceed the shorter
+        # string, nor the shared character counts
+        if total:
+            if 2.0 * min(len(q1), len(q2)) / total < threshold:
+                continue
+            if char_counts[i] is None:
+                char_counts[i] = Counter(q1)
+            if char_counts[j] is None:
+                char_counts[j] = Counter(q2)
+            if 2.0 * sum((char_counts[i] & char_counts[j]).values()) / total < threshold:
+                continue
+        
+        similarity = SequenceMatcher(None, q1, q2).ratio()
+        if similarity >= threshold:
+            near_dupes.append((i, j))
     
     return near_dupes
 
 
-def validate_answer_grounding(answer: str, article_content: str) -> tuple[bool, list[str]]:
+def extract_numbers(text: str) -> frozenset[str]:
+    """Numbers, prices and percentages mentioned in text."""
+    return frozenset(_NUMBER_RE.findall(text))
+
+
+def validate_answer_grounding(answer: str, article_content: Optional[str] = None,
+                              article_numbers: Optional[frozenset[str]] = None) -> tuple[bool, list[str]]:
     """Basic check that answer content appears grounded in article.
     
+    article_numbers may be passed instead of article_content when
+    extract_numbers() has already been run on the article, e.g. because
+    several answers come from the same article.
+    
     Returns (is_grounded, list of potentially hallucinated terms).
     """
     # Extract numbers and specific terms from answer
-    answer_numbers = set(re.findall(r'\$?\d+(?:,\d{3})*(?:\.\d+)?%?', answer))
-    article_numbers = set(re.findall(r'\$?\d+(?:,\d{3})*(?:\.\d+)?%?', article_content))
+    answer_numbers = extract_numbers(answer)
+    if article_numbers is None:
+        article_numbers = extract_numbers(article_content)
     
     # Check if numbers in answer exist in article
     ungrounded = []
@@ -102,25 +260,23 @@ def validate_answer_grounding(answer: str, article_content: str) -> tuple[bool,
         if num not in article_numbers and num not in ['1', '2', '3', '4', '5']:  # Allow simple counts
             ungrounded.append(num)
     
-    # Check for hallucination markers
-    hallucination_markers = [
-        "I don't have information",
-        "I cannot find",
-        "not mentioned in",
-        "According to the article",
-        "based on the document",
-        "the article states",
-        "as mentioned in the article"
-    ]
-    
-    for marker in hallucination_markers:
-        if marker.lower() in answer.lower():
+    # Check for hallucination markers against a single lowercased copy
+    answer_lower = answer.lower()
+    for marker, marker_lower in _LOWERED_MARKERS:
+        if marker_lower in answer_lower:
             ungrounded.append(f"marker: {marker}")
     
     is_grounded = len(ungrounded) == 0
     return is_grounded, ungrounded
 
 
+def cosine_similarities(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Row-wise cosine similarity between two (N, d) matrices."""
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return np.einsum('ij,ij->i', a, b)
+
+
 def validate_question_format(question: str) -> tuple[bool, Optional[str]]:
     """Validate question is well-formed."""
     question = question.strip()
@@ -129,7 +285,7 @@ def validate_question_format(question: str) -> tuple[bool, Optional[str]]:
         return False, "Empty question"
     
     # Check it ends with question mark or is a statement-style query
-    if not question.endswith('?') and not any(question.lower().startswith(w) for w in ['how', 'what', 'when', 'where', 'why', 'who', 'can', 'do', 'does', 'is', 'are', 'will', 'should']):
+    if not question.endswith('?') and not question.lower().startswith(_QUESTION_STARTERS):
         # Allow brief statement-style queries like "Commission rates"
         if len(question) > 30:
             return False, "Long question should end with '?'"
@@ -144,11 +300,11 @@ def parse_questions_json(response: str) -> list[dict]:
     
     # Handle markdown code blocks
     if '```json' in response:
-        match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
+        match = _JSON_CODE_BLOCK_RE.search(response)
         if match:
             response = match.group(1)
     elif '```' in response:
-        match = re.search(r'```\s*(.*?)\s*```', response, re.DOTALL)
+        match = _CODE_BLOCK_RE.search(response)
         if match:
             response = match.group(1)
     
@@ -172,18 +328,44 @@ def parse_questions_json(response: str) -> list[dict]:
         return []
 
 
-def deduplicate_qa_pairs(qa_pairs: list[dict], config: dict) -> tuple[list[dict], dict]:
-    """Remove duplicate Q&A pairs and return deduped list with stats."""
+def deduplicate_qa_pairs(qa_pairs: list[dict], config: dict, embeddings=None) -> tuple[list[dict], dict]:
+    """Remove duplicate Q&A pairs and return deduped list with stats.
+    
+    Near-duplicate checks only run on candidate pairs: nearest neighbours of
+    the question embeddings (one row per pair) if given, otherwise pairs
+    with similar character n-gram TF-IDF vectors. Without either (no
+    tfidf_candidate_threshold configured), every pair is compared.
+    """
     threshold = config['validation']['similarity_threshold']
     
+    # Normalize each question once for all the checks below
+    questions = [normalize_question(pair['question']) for pair in qa_pairs]
+    
     # Remove exact duplicates
-    exact_dupes = check_exact_duplicates(qa_pairs)
+    exact_dupes = check_exact_duplicates(qa_pairs, questions)
+    exact_set = set(exact_dupes)
     
     # Create list without exact duplicates
-    no_exact = [pair for i, pair in enumerate(qa_pairs) if i not in exact_dupes]
+    keep = [i for i in range(len(qa_pairs)) if i not in exact_set]
+    no_exact = [qa_pairs[i] for i in keep]
+    no_exact_questions = [questions[i] for i in keep]
     
     # Find near duplicates
-    near_dupes = check_near_duplicates(no_exact, threshold)
+    candidates = None
+    if embeddings is not None:
+        candidates = find_near_duplicate_candidates(
+            embeddings[keep],
+            k=config['validation'].get('near_dup_neighbors', 5),
+            threshold=config['validation'].get('embedding_candidate_threshold', 0.85)
+        )
+    elif config['validation'].get('tfidf_candidate_threshold') is not None:
+        candidates = find_tfidf_candidates(
+            no_exact_questions,
+            threshold=config['validation']['tfidf_candidate_threshold']
+        )
+    if candidates is not None:
+        logger.info(f"Comparing {len(candidates)} near-duplicate candidate pairs")
+    near_dupes = check_near_duplicates(no_exact, threshold, candidates, no_exact_questions)
     
     # Remove second item from each near-duplicate pair
     near_dupe_indices = set(j for i, j in near_dupes)
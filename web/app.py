@@ -8,13 +8,15 @@ FastAPI backend with SSE streaming for real-time responses.
 import os
 import sys
 import json
+import time
+import asyncio
 from pathlib import Path
 from contextlib import asynccontextmanager
-from typing import Optional, Dict
+from typing import Optional
 
-import yaml
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
@@ -23,25 +25,26 @@ from sse_starlette.sse import EventSourceResponse
 # Add parent to path for config access
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from utils.config import load_config
+
 # Global state
 config = None
 client = None
 model_id = None
-sessions: Dict[str, dict] = {}
-
-
-def load_config() -> dict:
-    """Load configuration from config.yaml."""
-    config_path = Path(__file__).parent.parent / 'config' / 'config.yaml'
-    with open(config_path) as f:
-        return yaml.safe_load(f)
+system_prompts: dict = {}
+prompt_keys: list = []
+default_prompt = None
+sessions: Optional[TTLCache] = None
+rate_buckets: Optional[TTLCache] = None  # session_id -> (tokens, last refill time)
+chat_rate = 0.5
+chat_burst = 5
 
 
-def setup_client() -> OpenAI:
-    """Initialize OpenAI client with API key from .env."""
+def setup_client() -> AsyncOpenAI:
+    """Initialize async OpenAI client with API key from .env."""
     env_path = Path(__file__).parent.parent / '.env'
     load_dotenv(dotenv_path=env_path)
-    return OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    return AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 
 def load_model_id(cfg: dict) -> Optional[str]:
@@ -58,22 +61,62 @@ def load_model_id(cfg: dict) -> Optional[str]:
 
 
 def get_or_create_session(session_id: str) -> dict:
-    """Get existing session or create new one with default system prompt."""
-    if session_id not in sessions:
-        system_prompt = config['system_prompts']['default']
-        sessions[session_id] = {
-            "messages": [{"role": "system", "content": system_prompt}],
-            "system_prompt_key": "default"
+    """Get existing session or create new one with default system prompt.
+    
+    Storing the session again restarts its TTL, so only idle sessions expire.
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        session = {
+            "messages": [{"role": "system", "content": default_prompt}],
+            "system_prompt_key": "default",
+            # Held for a whole chat turn so concurrent turns don't interleave
+            "lock": asyncio.Lock()
         }
-    return sessions[session_id]
+    sessions[session_id] = session
+    return session
+
+
+def allow_chat_request(session_id: str) -> bool:
+    """Take a token from the session's bucket, refilled at chat_rate per second.
+    
+    Buckets expire once they would be full again, so a missing bucket is
+    simply a full one.
+    """
+    now = time.monotonic()
+    tokens, last = rate_buckets.get(session_id, (chat_burst, now))
+    tokens = min(chat_burst, tokens + (now - last) * chat_rate)
+    if tokens < 1:
+        return False
+    rate_buckets[session_id] = (tokens - 1, now)
+    return True
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize resources on startup."""
-    global config, client, model_id
+    global config, client, model_id, sessions, rate_buckets, chat_rate, chat_burst
+    global system_prompts, prompt_keys, default_prompt
     config = load_config()
+    system_prompts = config['system_prompts']
+    prompt_keys = list(system_prompts)
+    default_prompt = system_prompts['default']
     client = setup_client()
+    web_config = config.get('web', {})
+    sessions = TTLCache(
+        maxsize=web_config.get('max_sessions', 10000),
+        ttl=web_config.get('session_ttl_seconds', 3600)
+    )
+    chat_rate = web_config.get('chat_requests_per_second', chat_rate)
+    chat_burst = web_config.get('chat_burst_size', chat_burst)
+    if chat_rate <= 0:
+        raise ValueError(f"web.chat_requests_per_second must be positive, got {chat_rate}")
+    if chat_burst < 1:
+        raise ValueError(f"web.chat_burst_size must be at least 1, got {chat_burst}")
+    rate_buckets = TTLCache(
+        maxsize=web_config.get('max_sessions', 10000),
+        ttl=chat_burst / chat_rate
+    )
     model_id = load_model_id(config)
 
     if not model_id:
@@ -81,8 +124,9 @@ async def lifespan(app: FastAPI):
         model_id = "ft:gpt-4.1-2025-04-14:personal:atom-support:CpnziPun"
 
     print(f"Loaded model: {model_id}")
-    print(f"Available system prompts: {list(config['system_prompts'].keys())}")
+    print(f"Available system prompts: {prompt_keys}")
     yield
+    await client.close()
 
 
 app = FastAPI(
@@ -117,7 +161,7 @@ async def serve_frontend():
 @app.get("/api/prompts")
 async def get_prompts():
     """Return available system prompt keys."""
-    return {"prompts": list(config['system_prompts'].keys())}
+    return {"prompts": prompt_keys}
 
 
 @app.get("/api/model")
@@ -129,32 +173,37 @@ async def get_model():
 @app.post("/api/chat")
 async def chat(request: ChatRequest):
     """Stream chat response using Server-Sent Events."""
-    session = get_or_create_session(request.session_id)
+    if not allow_chat_request(request.session_id):
+        raise HTTPException(status_code=429, detail="Too many messages, please slow down")
 
-    # Add user message to history
-    session['messages'].append({"role": "user", "content": request.message})
+    session = get_or_create_session(request.session_id)
 
     async def generate():
         collected_response = ""
-        try:
-            stream = client.chat.completions.create(
-                model=model_id,
-                messages=session['messages'],
-                stream=True
-            )
-
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    content = chunk.choices[0].delta.content
-                    collected_response += content
-                    yield {"event": "message", "data": json.dumps({"content": content})}
-
-            # Add complete response to history
-            session['messages'].append({"role": "assistant", "content": collected_response})
-            yield {"event": "done", "data": json.dumps({"complete": True})}
-
-        except Exception as e:
-            yield {"event": "error", "data": json.dumps({"error": str(e)})}
+        # One turn at a time per session, so each reply follows its own message
+        async with session['lock']:
+            # Add user message to history
+            session['messages'].append({"role": "user", "content": request.message})
+            try:
+                # Async client so a long generation doesn't block other requests
+                stream = await client.chat.completions.create(
+                    model=model_id,
+                    messages=session['messages'],
+                    stream=True
+                )
+
+                async for chunk in stream:
+                    if chunk.choices[0].delta.content is not None:
+                        content = chunk.choices[0].delta.content
+                        collected_response += content
+                        yield {"event": "message", "data": json.dumps({"content": content})}
+
+                # Add complete response to history
+                session['messages'].append({"role": "assistant", "content": collected_response})
+                yield {"event": "done", "data": json.dumps({"complete": True})}
+
+            except Exception as e:
+                yield {"event": "error", "data": json.dumps({"error": str(e)})}
 
     return EventSourceResponse(generate())
 
@@ -163,10 +212,7 @@ async def chat(request: ChatRequest):
 async def clear_history(request: ClearRequest):
     """Clear conversation history, keeping system prompt."""
     session = get_or_create_session(request.session_id)
-    system_prompt = config['system_prompts'].get(
-        session['system_prompt_key'],
-        config['system_prompts']['default']
-    )
+    system_prompt = system_prompts.get(session['system_prompt_key'], default_prompt)
     session['messages'] = [{"role": "system", "content": system_prompt}]
     return {"status": "cleared"}
 
@@ -174,7 +220,7 @@ async def clear_history(request: ClearRequest):
 @app.post("/api/system")
 async def switch_system_prompt(request: SystemPromptRequest):
     """Switch system prompt and clear history."""
-    if request.prompt_key not in config['system_prompts']:
+    if request.prompt_key not in system_prompts:
         raise HTTPException(
             status_code=400,
             detail=f"Unknown prompt key: {request.prompt_key}"
@@ -182,7 +228,7 @@ async def switch_system_prompt(request: SystemPromptRequest):
 
     session = get_or_create_session(request.session_id)
     session['system_prompt_key'] = request.prompt_key
-    system_prompt = config['system_prompts'][request.prompt_key]
+    system_prompt = system_prompts[request.prompt_key]
     session['messages'] = [{"role": "system", "content": system_prompt}]
 
     return {"status": "switched", "prompt_key": request.prompt_key}